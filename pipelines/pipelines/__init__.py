@@ -1,13 +1,35 @@
+import os
+
 from dagster import Definitions
 
-from pipelines.assets import upload_data
-from pipelines.jobs import daily_upload_job
+from pipelines.assets import (
+    parsed_frames,
+    raw_blobs,
+    stream_upload_data,
+    upload_data,
+    validated_frames,
+)
+from pipelines.io_managers import LocalParquetIOManager
+from pipelines.jobs import daily_upload_job, streaming_upload_job
 from pipelines.schedules import daily_upload_schedule
+from pipelines.sensors.blob_arrival import blob_arrival_sensor
 from pipelines.sensors.email import email_on_run_failure
 
 defs = Definitions(
-    assets=[upload_data],
-    jobs=[daily_upload_job],
+    assets=[
+        raw_blobs,
+        parsed_frames,
+        validated_frames,
+        upload_data,
+        stream_upload_data,
+    ],
+    jobs=[daily_upload_job, streaming_upload_job],
     schedules=[daily_upload_schedule],
-    sensors=[email_on_run_failure],
+    sensors=[email_on_run_failure, blob_arrival_sensor],
+    resources={
+        "parquet_io_manager": LocalParquetIOManager(
+            base_dir="/opt/dagster/local/frames",
+            retention_days=float(os.getenv("FRAMES_RETENTION_DAYS", "7")),
+        ),
+    },
 )
@@ -1,199 +1,556 @@
 import datetime as dt
+from typing import Iterator
 
 import pandas as pd
-from dagster import asset
+from dagster import (
+    AssetExecutionContext,
+    Config,
+    DailyPartitionsDefinition,
+    asset,
+)
+from sqlalchemy import Engine
 
-from pipelines.funcs import blob_init, sql_init, upload, upload_many_to_many
-from pipelines.read_blobs import read_anime, read_anime_and_manga, read_manga
-from pipelines.tests import test_anime, test_anime_and_manga, test_manga
+from pipelines.funcs import (
+    MediaCache,
+    blob_init,
+    completed_users,
+    record_checkpoint,
+    refresh_user_stats,
+    sql_init,
+    transaction,
+    upload,
+    upload_batch,
+    upload_many_to_many,
+    upload_many_to_many_batch,
+)
+from pipelines.metrics import (
+    StageTimer,
+    frame_bytes,
+    frame_rows,
+    user_latency_metadata,
+)
+from pipelines.read_blobs import (
+    concat_frames,
+    download_blobs,
+    group_blobs,
+    iter_user_blobs,
+    parse_blobs,
+    split_frames,
+    stream_frames,
+    user_id_from_blob,
+)
+from pipelines.tests import test_report, validate_frames
 
+# NOTE: The current day is a partition too, so the blob arrival sensor can
+# load users as they query. The daily schedule still loads the previous day.
+daily_partitions = DailyPartitionsDefinition(start_date="2024-07-01", end_offset=1)
 
-@asset()
-def upload_data() -> None:
-    engine = sql_init()
-    blob_service_client = blob_init()
 
-    container_id = "projectanilist"
-    container_client = blob_service_client.get_container_client(container_id)
-    yesterday = dt.date.today() - dt.timedelta(days=1)
+class PoolConfig(Config):
+    max_workers: int = 8
 
-    blobs = container_client.list_blobs(name_starts_with=f"data/{str(yesterday)}")
-    blob_names = [blob["name"] for blob in blobs]
 
-    split_names = [name.split("/") for name in blob_names]
-    ids = []
-    for name in split_names:
-        ids.append(int(name[2]))
+class RawBlobsConfig(PoolConfig):
+    user_ids: list[int] | None = None
 
-    unique_ids = set(ids)
-    blobs_by_user = dict.fromkeys(unique_ids)
 
-    insert_date = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+class StreamUploadConfig(Config):
+    max_workers: int = 8
+    batch_size: int = 100
+    diff_history: bool = True
+    resume: bool = True
 
-    for key in unique_ids:
-        blobs = [name for name in blob_names if str(key) in name]
-        blobs = sorted(blobs)
-        assert (
-            len(blobs) == 3 or len(blobs) == 5
-        ), f"Unexpected number of blobs ({len(blobs)}) for user {key}: {blobs}"
-        blobs_by_user[key] = blobs
-
-    for blobs in blobs_by_user.values():
-        if blobs == None:
-            print("No blobs found.")
-            break
-        else:
-            manga = False
-            for blob in blobs:
-                if "user_manga_score.csv" and "manga_info.csv" in blob:
-                    manga = True
-            if len(blobs) == 5:
-                (
-                    dfs,
-                    anime_info,
-                    manga_info,
-                    user_anime_score,
-                    user_info,
-                    user_manga_score,
-                ) = read_anime_and_manga(
-                    blob_service_client=blob_service_client,
-                    container_id=container_id,
-                    blobs=blobs,
-                    insert_date=insert_date,
-                )
-                test_anime_and_manga(
-                    dfs=dfs,
-                    anime_info=anime_info,
-                    manga_info=manga_info,
-                    user_anime_score=user_anime_score,
-                    user_info=user_info,
-                    user_manga_score=user_manga_score,
-                )
-                upload(
-                    df=anime_info,
-                    table_name="anime_info",
-                    primary_key="anime_id",
-                    column_1="average_score",
-                    column_2="title_romaji",
-                    engine=engine,
-                )
-                upload(
-                    df=manga_info,
-                    table_name="manga_info",
-                    primary_key="manga_id",
-                    column_1="average_score",
-                    column_2="title_romaji",
-                    engine=engine,
-                )
-                upload(
-                    df=user_info,
-                    table_name="user_info",
-                    primary_key="user_id",
-                    column_1="user_name",
-                    column_2="request_date",
-                    engine=engine,
-                )
 
-                anilist_id = user_manga_score.iloc[0]["user_id"]
-                upload_many_to_many(
-                    df=user_anime_score,
-                    table_name="user_anime_score",
-                    foreign_key_1="user_id",
-                    foreign_key_2="anime_id",
-                    column_1="user_score",
-                    anilist_id=anilist_id,
-                    insert_date=insert_date,
-                    engine=engine,
+class ValidationConfig(Config):
+    drop_invalid_users: bool = False
+
+
+class UploadDataConfig(Config):
+    batch_load: bool = True
+    batch_size: int = 1000
+    diff_history: bool = True
+    resume: bool = True
+
+
+def load_scores(
+    frames: dict[str, pd.DataFrame], insert_date: str, engine: Engine
+) -> None:
+    anilist_id = frames["user_info"].iloc[0]["user_id"]
+    for format in ["anime", "manga"]:
+        if f"user_{format}_score" in frames:
+            upload_many_to_many(
+                df=frames[f"user_{format}_score"],
+                table_name=f"user_{format}_score",
+                foreign_key_1="user_id",
+                foreign_key_2=f"{format}_id",
+                column_1="user_score",
+                anilist_id=anilist_id,
+                insert_date=insert_date,
+                engine=engine,
+            )
+            with engine.begin() as connection:
+                refresh_user_stats(
+                    connection=connection,
+                    format=format,
+                    user_ids=[anilist_id],
+                    updated_at=insert_date,
                 )
-                upload_many_to_many(
-                    df=user_manga_score,
-                    table_name="user_manga_score",
+
+
+def load_user(
+    frames: dict[str, pd.DataFrame],
+    insert_date: str,
+    engine: Engine,
+    staging_suffix: str = "",
+) -> None:
+    for format in ["anime", "manga"]:
+        if f"{format}_info" in frames:
+            upload(
+                df=frames[f"{format}_info"].drop(columns="user_id"),
+                table_name=f"{format}_info",
+                primary_key=f"{format}_id",
+                column_1="average_score",
+                column_2="title_romaji",
+                engine=engine,
+                staging_suffix=staging_suffix,
+            )
+    upload(
+        df=frames["user_info"],
+        table_name="user_info",
+        primary_key="user_id",
+        column_1="user_name",
+        column_2="request_date",
+        engine=engine,
+        staging_suffix=staging_suffix,
+    )
+
+    load_scores(frames=frames, insert_date=insert_date, engine=engine)
+
+
+def merge_batch(
+    frames: dict[str, pd.DataFrame],
+    engine: Engine,
+    staging_suffix: str = "",
+    media_cache: MediaCache | None = None,
+) -> None:
+    for format in ["anime", "manga"]:
+        if f"{format}_info" in frames and not frames[f"{format}_info"].empty:
+            upload_batch(
+                dfs=[frames[f"{format}_info"]],
+                table_name=f"{format}_info",
+                primary_key=f"{format}_id",
+                column_1="average_score",
+                column_2="title_romaji",
+                engine=engine,
+                staging_suffix=staging_suffix,
+                media_cache=media_cache,
+            )
+    upload_batch(
+        dfs=[frames["user_info"]],
+        table_name="user_info",
+        primary_key="user_id",
+        column_1="user_name",
+        column_2="request_date",
+        engine=engine,
+        staging_suffix=staging_suffix,
+    )
+
+
+def write_history(
+    frames: dict[str, pd.DataFrame],
+    insert_date: str,
+    engine: Engine,
+    diff_history: bool = False,
+    staging_suffix: str = "",
+    ingest_date: str | None = None,
+) -> None:
+    # NOTE: The history writes, the derived tables and the checkpoint commit
+    # together, a retry either sees the batch as loaded or loads it again.
+    with transaction(engine) as connection:
+        for format in ["anime", "manga"]:
+            if (
+                f"user_{format}_score" in frames
+                and not frames[f"user_{format}_score"].empty
+            ):
+                upload_many_to_many_batch(
+                    dfs=[frames[f"user_{format}_score"]],
+                    table_name=f"user_{format}_score",
                     foreign_key_1="user_id",
-                    foreign_key_2="manga_id",
+                    foreign_key_2=f"{format}_id",
                     column_1="user_score",
-                    anilist_id=anilist_id,
                     insert_date=insert_date,
-                    engine=engine,
+                    engine=connection,
+                    diff=diff_history,
+                    staging_suffix=staging_suffix,
                 )
-            elif len(blobs) == 3 and manga == False:
-                dfs, anime_info, user_anime_score, user_info = read_anime(
-                    blob_service_client=blob_service_client,
-                    container_id=container_id,
-                    blobs=blobs,
-                    insert_date=insert_date,
-                )
-                test_anime(
-                    dfs=dfs,
-                    anime_info=anime_info,
-                    user_anime_score=user_anime_score,
-                    user_info=user_info,
-                )
-                upload(
-                    df=anime_info,
-                    table_name="anime_info",
-                    primary_key="anime_id",
-                    column_1="average_score",
-                    column_2="title_romaji",
-                    engine=engine,
-                )
-                upload(
-                    df=user_info,
-                    table_name="user_info",
-                    primary_key="user_id",
-                    column_1="user_name",
-                    column_2="request_date",
-                    engine=engine,
+                refresh_user_stats(
+                    connection=connection,
+                    format=format,
+                    user_ids=frames[f"user_{format}_score"]["user_id"].unique(),
+                    updated_at=insert_date,
                 )
+        if ingest_date is not None:
+            record_checkpoint(
+                user_info=frames["user_info"],
+                ingest_date=ingest_date,
+                loaded_at=insert_date,
+                engine=connection,
+            )
 
-                anilist_id = user_anime_score.iloc[0]["user_id"]
-                upload_many_to_many(
-                    df=user_anime_score,
-                    table_name="user_anime_score",
-                    foreign_key_1="user_id",
-                    foreign_key_2="anime_id",
-                    column_1="user_score",
-                    anilist_id=anilist_id,
-                    insert_date=insert_date,
-                    engine=engine,
-                )
-            elif len(blobs) == 3 and manga == True:
-                dfs, manga_info, user_info, user_manga_score = read_manga(
-                    blob_service_client=blob_service_client,
-                    container_id=container_id,
-                    blobs=blobs,
+
+def load_batch(
+    frames: dict[str, pd.DataFrame],
+    insert_date: str,
+    engine: Engine,
+    diff_history: bool = False,
+    staging_suffix: str = "",
+    media_cache: MediaCache | None = None,
+    timer: StageTimer | None = None,
+    ingest_date: str | None = None,
+) -> None:
+    timer = timer or StageTimer()
+    info_tables = ["anime_info", "manga_info", "user_info"]
+    score_tables = ["user_anime_score", "user_manga_score"]
+
+    with timer.stage("merge") as volume:
+        merge_batch(
+            frames=frames,
+            engine=engine,
+            staging_suffix=staging_suffix,
+            media_cache=media_cache,
+        )
+        merged = {name: df for name, df in frames.items() if name in info_tables}
+        volume["rows"] = frame_rows(merged)
+        volume["bytes"] = frame_bytes(merged)
+
+    with timer.stage("history") as volume:
+        write_history(
+            frames=frames,
+            insert_date=insert_date,
+            engine=engine,
+            diff_history=diff_history,
+            staging_suffix=staging_suffix,
+            ingest_date=ingest_date,
+        )
+        scores = {name: df for name, df in frames.items() if name in score_tables}
+        volume["rows"] = frame_rows(scores)
+        volume["bytes"] = frame_bytes(scores)
+
+
+def skip_completed(
+    frames: dict[str, pd.DataFrame], checkpoints: pd.Series
+) -> tuple[dict[str, pd.DataFrame], int]:
+    user_info = frames["user_info"]
+    checkpointed = checkpoints.reindex(user_info["user_id"]).to_numpy()
+    completed = pd.notna(checkpointed) & (
+        user_info["last_modified"].to_numpy() <= checkpointed
+    )
+    skip_ids = user_info.loc[completed, "user_id"]
+    frames = {
+        name: df.loc[~df["user_id"].isin(skip_ids)] for name, df in frames.items()
+    }
+    return frames, len(skip_ids)
+
+
+@asset(partitions_def=daily_partitions, io_manager_key="parquet_io_manager")
+def raw_blobs(context: AssetExecutionContext, config: RawBlobsConfig) -> pd.DataFrame:
+    blob_service_client = blob_init()
+    timer = StageTimer(context.log)
+
+    container_id = "projectanilist"
+    container_client = blob_service_client.get_container_client(container_id)
+    partition_date = context.partition_key
+
+    # NOTE: The listing is consumed as it is paged in, only the names grouped
+    # by user and each user's latest upload time are kept.
+    last_modified: dict[int, dt.datetime] = {}
+
+    def listed_blobs(volume: dict[str, int]) -> Iterator[dict]:
+        for blob in container_client.list_blobs(
+            name_starts_with=f"data/{partition_date}/"
+        ):
+            user_id = user_id_from_blob(blob["name"])
+            # NOTE: Micro-batch runs only load the users the sensor saw arrive,
+            # other users of the day may still be mid-upload.
+            if config.user_ids is not None and user_id not in config.user_ids:
+                continue
+            volume["rows"] += 1
+            volume["bytes"] += blob["size"]
+            last_modified[user_id] = max(
+                blob["last_modified"],
+                last_modified.get(user_id, blob["last_modified"]),
+            )
+            yield blob
+
+    with timer.stage("list") as volume:
+        blobs_by_user = group_blobs(listed_blobs(volume))
+
+    if not blobs_by_user:
+        context.log.info("No blobs found.")
+
+    with timer.stage("download") as volume:
+        raw_blobs = download_blobs(
+            blob_service_client=blob_service_client,
+            container_id=container_id,
+            blobs_by_user=blobs_by_user,
+            max_workers=config.max_workers,
+        )
+        volume["rows"] = len(raw_blobs)
+        volume["bytes"] = int(raw_blobs["content"].map(len).sum())
+
+    raw_blobs["last_modified"] = pd.to_datetime(
+        raw_blobs["user_id"].map(last_modified), utc=True
+    ).dt.tz_localize(None)
+
+    user_seconds = raw_blobs.groupby("user_id")["seconds"].sum()
+    context.add_output_metadata(
+        {
+            "users": len(blobs_by_user),
+            **timer.metadata(),
+            **user_latency_metadata(user_seconds, "download"),
+        }
+    )
+    return raw_blobs
+
+
+@asset(partitions_def=daily_partitions, io_manager_key="parquet_io_manager")
+def parsed_frames(
+    context: AssetExecutionContext, config: PoolConfig, raw_blobs: pd.DataFrame
+) -> dict[str, pd.DataFrame]:
+    timer = StageTimer(context.log)
+    # NOTE: start_date is set again at load time, this is only a placeholder
+    # so the parsed frames match the score table layout.
+    insert_date = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+    user_seconds = {}
+    with timer.stage("parse") as volume:
+        frames = parse_blobs(
+            raw_blobs=raw_blobs,
+            insert_date=insert_date,
+            max_workers=config.max_workers,
+            timings=user_seconds,
+        )
+        volume["rows"] = frame_rows(frames)
+        volume["bytes"] = int(raw_blobs["content"].map(len).sum())
+
+    if "user_info" in frames:
+        last_modified = raw_blobs.groupby("user_id")["last_modified"].max()
+        frames["user_info"]["last_modified"] = frames["user_info"]["user_id"].map(
+            last_modified
+        )
+
+    context.add_output_metadata(
+        {
+            **timer.metadata(),
+            **user_latency_metadata(pd.Series(user_seconds, dtype=float), "parse"),
+        }
+    )
+    return frames
+
+
+@asset(partitions_def=daily_partitions, io_manager_key="parquet_io_manager")
+def validated_frames(
+    context: AssetExecutionContext,
+    config: ValidationConfig,
+    parsed_frames: dict[str, pd.DataFrame],
+) -> dict[str, pd.DataFrame]:
+    timer = StageTimer(context.log)
+    with timer.stage("validate") as volume:
+        report = validate_frames(parsed_frames)
+        volume["rows"] = frame_rows(parsed_frames)
+        volume["bytes"] = frame_bytes(parsed_frames)
+
+    context.add_output_metadata(
+        {
+            "failed_users": report["user_id"].nunique(),
+            "report": report.to_dict(orient="records"),
+            **timer.metadata(),
+        }
+    )
+
+    if report.empty or not config.drop_invalid_users:
+        test_report(report)
+        return parsed_frames
+
+    context.log.warning(f"Dropping users that failed validation:\n{report}")
+    invalid_users = report["user_id"].unique()
+    return {
+        name: df.loc[~df["user_id"].isin(invalid_users)].reset_index(drop=True)
+        for name, df in parsed_frames.items()
+    }
+
+
+@asset(partitions_def=daily_partitions)
+def upload_data(
+    context: AssetExecutionContext,
+    config: UploadDataConfig,
+    validated_frames: dict[str, pd.DataFrame],
+) -> None:
+    if "user_info" not in validated_frames:
+        context.log.info("No blobs found.")
+        return
+
+    engine = sql_init()
+    timer = StageTimer(context.log)
+    partition_date = context.partition_key
+    # NOTE: Partitions of a backfill run concurrently, so each one stages into
+    # its own tables.
+    staging_suffix = f"_{partition_date.replace('-', '')}"
+
+    insert_date = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    for format in ["anime", "manga"]:
+        if f"user_{format}_score" in validated_frames:
+            validated_frames[f"user_{format}_score"]["start_date"] = insert_date
+
+    # NOTE: Users checkpointed by an earlier attempt at this partition are
+    # skipped, unless their blobs were uploaded again since.
+    skipped_users = 0
+    if config.resume:
+        validated_frames, skipped_users = skip_completed(
+            validated_frames, completed_users(engine, partition_date)
+        )
+        if skipped_users:
+            context.log.info(f"Skipping {skipped_users} users loaded previously.")
+
+    if not config.batch_load:
+        for frames in split_frames(validated_frames).values():
+            with timer.stage("load") as volume:
+                load_user(
+                    frames=frames,
                     insert_date=insert_date,
-                )
-                test_manga(
-                    dfs=dfs,
-                    manga_info=manga_info,
-                    user_info=user_info,
-                    user_manga_score=user_manga_score,
-                )
-                upload(
-                    df=manga_info,
-                    table_name="manga_info",
-                    primary_key="manga_id",
-                    column_1="average_score",
-                    column_2="title_romaji",
                     engine=engine,
+                    staging_suffix=staging_suffix,
                 )
-                upload(
-                    df=user_info,
-                    table_name="user_info",
-                    primary_key="user_id",
-                    column_1="user_name",
-                    column_2="request_date",
+                record_checkpoint(
+                    user_info=frames["user_info"],
+                    ingest_date=partition_date,
+                    loaded_at=insert_date,
                     engine=engine,
                 )
+                volume["rows"] = frame_rows(frames)
+        context.add_output_metadata(
+            {"skipped_users": skipped_users, **timer.metadata()}
+        )
+        return
 
-                anilist_id = user_manga_score.iloc[0]["user_id"]
-                upload_many_to_many(
-                    df=user_manga_score,
-                    table_name="user_manga_score",
-                    foreign_key_1="user_id",
-                    foreign_key_2="manga_id",
-                    column_1="user_score",
-                    anilist_id=anilist_id,
-                    insert_date=insert_date,
-                    engine=engine,
-                )
+    # NOTE: Users are written in batches of batch_size with one MERGE per table.
+    # Media rows already written with the same content earlier in the run or in
+    # the database are skipped via the media cache.
+    media_cache = MediaCache(engine)
+    user_ids = validated_frames["user_info"]["user_id"].unique()
+    for i in range(0, len(user_ids), config.batch_size):
+        batch_ids = user_ids[i : i + config.batch_size]
+        batch = {
+            name: df.loc[df["user_id"].isin(batch_ids)]
+            for name, df in validated_frames.items()
+        }
+        load_batch(
+            frames=batch,
+            insert_date=insert_date,
+            engine=engine,
+            diff_history=config.diff_history,
+            staging_suffix=staging_suffix,
+            media_cache=media_cache,
+            timer=timer,
+            ingest_date=partition_date,
+        )
+
+    context.add_output_metadata(
+        {"users": len(user_ids), "skipped_users": skipped_users, **timer.metadata()}
+    )
+
+
+@asset(partitions_def=daily_partitions)
+def stream_upload_data(
+    context: AssetExecutionContext, config: StreamUploadConfig
+) -> None:
+    engine = sql_init()
+    blob_service_client = blob_init()
+
+    container_id = "projectanilist"
+    container_client = blob_service_client.get_container_client(container_id)
+    partition_date = context.partition_key
+    staging_suffix = f"_{partition_date.replace('-', '')}"
+    insert_date = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    media_cache = MediaCache(engine)
+    timer = StageTimer(context.log)
+    checkpoints = (
+        completed_users(engine, partition_date)
+        if config.resume
+        else pd.Series(dtype="datetime64[ns]")
+    )
+    skipped_users = 0
+
+    # NOTE: Each user's latest upload time is kept until their batch is
+    # loaded, so checkpoints work the same as for upload_data.
+    last_modified: dict[int, dt.datetime] = {}
+
+    def listed_blobs() -> Iterator[dict]:
+        for blob in container_client.list_blobs(
+            name_starts_with=f"data/{partition_date}/"
+        ):
+            user_id = user_id_from_blob(blob["name"])
+            last_modified[user_id] = max(
+                blob["last_modified"],
+                last_modified.get(user_id, blob["last_modified"]),
+            )
+            yield blob
+
+    def flush(batch: list[dict[str, pd.DataFrame]]) -> None:
+        nonlocal skipped_users
+        frames = concat_frames(batch)
+        user_ids = frames["user_info"]["user_id"]
+        frames["user_info"]["last_modified"] = pd.to_datetime(
+            [last_modified.pop(user_id) for user_id in user_ids], utc=True
+        ).tz_localize(None)
+
+        frames, skipped = skip_completed(frames, checkpoints)
+        skipped_users += skipped
+        if frames["user_info"].empty:
+            return
+
+        with timer.stage("validate") as volume:
+            report = validate_frames(frames)
+            volume["rows"] = frame_rows(frames)
+        test_report(report)
+        load_batch(
+            frames=frames,
+            insert_date=insert_date,
+            engine=engine,
+            diff_history=config.diff_history,
+            staging_suffix=staging_suffix,
+            media_cache=media_cache,
+            timer=timer,
+            ingest_date=partition_date,
+        )
+
+    # NOTE: The listing, the downloads and the loads are all streamed, only
+    # batch_size users are held in memory at a time.
+    user_frames = stream_frames(
+        blob_service_client=blob_service_client,
+        container_id=container_id,
+        user_blobs=iter_user_blobs(listed_blobs()),
+        insert_date=insert_date,
+        max_workers=config.max_workers,
+    )
+
+    batch = []
+    users = 0
+    for frames in user_frames:
+        batch.append(frames)
+        if len(batch) >= config.batch_size:
+            flush(batch)
+            users += len(batch)
+            batch = []
+
+    if batch:
+        flush(batch)
+        users += len(batch)
+
+    if users == 0:
+        context.log.info("No blobs found.")
+    if skipped_users:
+        context.log.info(f"Skipped {skipped_users} users loaded previously.")
+    context.add_output_metadata(
+        {"users": users, "skipped_users": skipped_users, **timer.metadata()}
+    )
@@ -1,33 +1,185 @@
+import json
 import os
-from urllib.parse import quote_plus
+from contextlib import contextmanager
+from typing import Iterator
 
 import pandas as pd
 from azure.storage.blob import BlobServiceClient
 from dotenv import load_dotenv
-from sqlalchemy import Engine, create_engine, text
-from sqlalchemy.engine import URL
-from sqlalchemy.exc import DataError
+from sqlalchemy import Connection, Engine, text
+
+from pipelines.db import get_engine
 
 
 def sql_init() -> Engine:
-    load_dotenv()
-    connection_string = os.environ["AZURE_ODBC"]
-    connection_url = URL.create(
-        "mssql+pyodbc", query={"odbc_connect": quote_plus(connection_string)}
-    )
-    engine = create_engine(connection_url)
-    return engine
+    return get_engine()
 
 
 def blob_init() -> BlobServiceClient:
     load_dotenv()
     storage_connection_string = os.environ["STORAGE_CONNECTION_STRING"]
     blob_service_client = BlobServiceClient.from_connection_string(
-        storage_connection_string
+        storage_connection_string,
+        max_single_get_size=4 * 1024 * 1024,
+        max_chunk_get_size=4 * 1024 * 1024,
     )
     return blob_service_client
 
 
+@contextmanager
+def transaction(engine: Engine | Connection) -> Iterator[Connection]:
+    # NOTE: Passing a connection lets callers group several writes into the
+    # transaction they already have open.
+    if isinstance(engine, Connection):
+        yield engine
+    else:
+        with engine.begin() as connection:
+            yield connection
+
+
+class MediaCache:
+    def __init__(self, engine):
+        self.engine = engine
+        self.hashes: dict[str, pd.Series] = {}
+
+    def get_hashes(self, table_name: str, primary_key: str) -> pd.Series:
+        if table_name not in self.hashes:
+            with self.engine.connect() as connection:
+                hashes = pd.read_sql(
+                    f"SELECT {primary_key}, content_hash FROM {table_name};",
+                    con=connection,
+                    dtype_backend="numpy_nullable",
+                )
+            self.hashes[table_name] = hashes.set_index(primary_key)["content_hash"]
+        return self.hashes[table_name]
+
+    def changed(
+        self, df: pd.DataFrame, table_name: str, primary_key: str
+    ) -> pd.DataFrame:
+        known = self.get_hashes(table_name, primary_key).reindex(df[primary_key])
+        changed = known.ne(df["content_hash"].to_numpy()).fillna(True)
+        return df.loc[changed.to_numpy()]
+
+    def update(self, df: pd.DataFrame, table_name: str, primary_key: str) -> None:
+        hashes = df.set_index(primary_key)["content_hash"].astype("Int64")
+        known = self.get_hashes(table_name, primary_key)
+        if not known.empty:
+            hashes = hashes.combine_first(known)
+        self.hashes[table_name] = hashes
+
+
+def merge_query(
+    source_table: str,
+    table_name: str,
+    primary_key: str,
+    columns: list[str],
+    dialect: str = "mssql",
+) -> str:
+    insert_columns = ", ".join([primary_key, *columns])
+    insert_values = ", ".join(f"source.{column}" for column in [primary_key, *columns])
+    update_columns = ", ".join(
+        f"target.{column} = source.{column}" for column in columns
+    )
+
+    # NOTE: SQLite has no MERGE, it is only used for local tests and benchmarks.
+    if dialect == "sqlite":
+        update_columns = ", ".join(
+            f"{column} = excluded.{column}" for column in columns
+        )
+        return f"""
+            INSERT INTO {table_name} ({insert_columns})
+            SELECT {insert_values} FROM {source_table} AS source WHERE true
+            ON CONFLICT ({primary_key}) DO UPDATE
+            SET {update_columns};
+        """
+
+    query = f"""
+        MERGE {table_name} WITH (HOLDLOCK) AS target USING {source_table} AS source
+        ON source.{primary_key} = target.{primary_key}
+        WHEN NOT MATCHED BY target
+        THEN INSERT ({insert_columns})
+        VALUES ({insert_values})
+        WHEN MATCHED THEN UPDATE
+        SET {update_columns};
+    """
+    return query
+
+
+def explode_genres(df: pd.DataFrame, primary_key: str) -> pd.DataFrame:
+    # NOTE: Most titles share a handful of genre lists, so each distinct JSON
+    # string is decoded once.
+    codes, uniques = pd.factorize(df["genres"])
+    names = [list(json.loads(genres).values()) for genres in uniques]
+    genres = pd.DataFrame(
+        {
+            "media_id": df[primary_key].to_numpy(),
+            "genre_name": [names[code] for code in codes],
+        }
+    )
+    return genres.explode("genre_name").dropna().drop_duplicates()
+
+
+def genre_merge_query(source_table: str, dialect: str = "mssql") -> str:
+    # NOTE: Partitions load concurrently, so new genres are inserted against
+    # the unique name constraint rather than checked for first.
+    if dialect == "sqlite":
+        return f"""
+            INSERT INTO genre (genre_name)
+            SELECT DISTINCT genre_name FROM {source_table} WHERE true
+            ON CONFLICT (genre_name) DO NOTHING;
+        """
+
+    query = f"""
+        MERGE genre WITH (HOLDLOCK) AS target
+        USING (SELECT DISTINCT genre_name FROM {source_table}) AS source
+        ON source.genre_name = target.genre_name
+        WHEN NOT MATCHED BY target
+        THEN INSERT (genre_name)
+        VALUES (source.genre_name);
+    """
+    return query
+
+
+def sync_media_genres(
+    connection: Connection,
+    df: pd.DataFrame,
+    table_name: str,
+    primary_key: str,
+    source_table: str,
+    staging_suffix: str = "",
+) -> None:
+    format = table_name.removesuffix("_info")
+    staging_table = f"media_genre_staging{staging_suffix}"
+
+    explode_genres(df, primary_key).to_sql(
+        staging_table, con=connection, if_exists="replace", index=False
+    )
+    connection.execute(
+        text(genre_merge_query(staging_table, dialect=connection.dialect.name))
+    )
+    connection.execute(
+        text(
+            f"""
+            DELETE FROM media_genre
+            WHERE format = '{format}'
+            AND media_id IN (SELECT {primary_key} FROM {source_table});
+            """
+        )
+    )
+    connection.execute(
+        text(
+            f"""
+            INSERT INTO media_genre (format, media_id, genre_id)
+            SELECT '{format}', staged.media_id, genre.genre_id
+            FROM {staging_table} AS staged
+            INNER JOIN genre
+            ON genre.genre_name = staged.genre_name;
+            """
+        )
+    )
+    connection.execute(text(f"DROP TABLE {staging_table};"))
+
+
 def upload(
     df: pd.DataFrame,
     table_name: str,
@@ -37,40 +189,177 @@ def upload(
     engine,
     column_3="genres",
     column_4="popularity",
+    column_5="content_hash",
+    staging_suffix: str = "",
 ) -> None:
-    with engine.connect() as connection:
-        df.to_sql("temp_table", con=connection, if_exists="replace")
+    if table_name in ["anime_info", "manga_info"]:
+        columns = [column_1, column_2, column_3, column_4, column_5]
+    else:
+        columns = [column_1, column_2]
+    staging_table = f"temp_table{staging_suffix}"
 
+    with engine.connect() as connection:
+        df.to_sql(staging_table, con=connection, if_exists="replace")
+        connection.execute(
+            text(
+                merge_query(
+                    staging_table,
+                    table_name,
+                    primary_key,
+                    columns,
+                    dialect=connection.dialect.name,
+                )
+            ),
+        )
         if table_name in ["anime_info", "manga_info"]:
-            query = f"""
-                    MERGE {table_name} AS target USING temp_table AS source
-                    ON source.{primary_key} = target.{primary_key}
-                    WHEN NOT MATCHED BY target
-                    THEN INSERT ({primary_key}, {column_1}, {column_2}, {column_3}, {column_4})
-                    VALUES (source.{primary_key}, source.{column_1}, source.{column_2}, source.{column_3}, source.{column_4})
-                    WHEN MATCHED THEN UPDATE 
-                    SET target.{column_1} = source.{column_1}, 
-                    target.{column_2} = source.{column_2},
-                    target.{column_3} = source.{column_3},
-                    target.{column_4} = source.{column_4};
-                """
-        else:
-            query = f"""
-                MERGE {table_name} AS target USING temp_table AS source
-                ON source.{primary_key} = target.{primary_key}
-                WHEN NOT MATCHED BY target
-                THEN INSERT ({primary_key}, {column_1}, {column_2})
-                VALUES (source.{primary_key}, source.{column_1}, source.{column_2})
-                WHEN MATCHED THEN UPDATE 
-                SET target.{column_1} = source.{column_1}, 
-                target.{column_2} = source.{column_2};
-            """
+            sync_media_genres(
+                connection=connection,
+                df=df,
+                table_name=table_name,
+                primary_key=primary_key,
+                source_table=staging_table,
+                staging_suffix=staging_suffix,
+            )
+        connection.execute(text(f"DROP TABLE {staging_table};"))
+        connection.commit()
+
+
+def upload_batch(
+    dfs: list[pd.DataFrame],
+    table_name: str,
+    primary_key: str,
+    column_1: str,
+    column_2: str,
+    engine,
+    column_3="genres",
+    column_4="popularity",
+    column_5="content_hash",
+    staging_suffix: str = "",
+    media_cache: MediaCache | None = None,
+) -> None:
+    if table_name in ["anime_info", "manga_info"]:
+        columns = [column_1, column_2, column_3, column_4, column_5]
+    else:
+        columns = [column_1, column_2]
+
+    df = pd.concat(dfs, ignore_index=True)
+    df = df.drop_duplicates(subset=primary_key, keep="last")
+    if media_cache is not None and table_name in ["anime_info", "manga_info"]:
+        df = media_cache.changed(df=df, table_name=table_name, primary_key=primary_key)
+        if df.empty:
+            return
+    staging_table = f"{table_name}_staging{staging_suffix}"
 
+    with engine.connect() as connection:
+        df[[primary_key, *columns]].to_sql(
+            staging_table, con=connection, if_exists="replace", index=False
+        )
         connection.execute(
-            text(query),
+            text(
+                merge_query(
+                    staging_table,
+                    table_name,
+                    primary_key,
+                    columns,
+                    dialect=connection.dialect.name,
+                )
+            ),
         )
+        # NOTE: Only media whose content changed are staged, so the genre
+        # bridge is only rewritten for them.
+        if table_name in ["anime_info", "manga_info"]:
+            sync_media_genres(
+                connection=connection,
+                df=df,
+                table_name=table_name,
+                primary_key=primary_key,
+                source_table=staging_table,
+                staging_suffix=staging_suffix,
+            )
+        connection.execute(text(f"DROP TABLE {staging_table};"))
         connection.commit()
 
+    if media_cache is not None and table_name in ["anime_info", "manga_info"]:
+        media_cache.update(df=df, table_name=table_name, primary_key=primary_key)
+
+
+def refresh_current_scores(
+    connection: Connection,
+    table_name: str,
+    foreign_key_1: str,
+    foreign_key_2: str,
+    column_1: str,
+    users_query: str,
+) -> None:
+    # NOTE: current_{table_name} holds only the open history rows, so the
+    # population reads never scan closed versions.
+    connection.execute(
+        text(
+            f"""
+            DELETE FROM current_{table_name}
+            WHERE {foreign_key_1} IN ({users_query});
+            """
+        )
+    )
+    connection.execute(
+        text(
+            f"""
+            INSERT INTO current_{table_name}
+            ({foreign_key_1}, {foreign_key_2}, {column_1}, start_date)
+            SELECT {foreign_key_1}, {foreign_key_2}, {column_1}, start_date
+            FROM (
+                SELECT
+                    {foreign_key_1}, {foreign_key_2}, {column_1}, start_date,
+                    ROW_NUMBER() OVER(
+                        PARTITION BY {foreign_key_1}, {foreign_key_2}
+                        ORDER BY start_date DESC
+                    ) AS rn
+                FROM {table_name}
+                WHERE {foreign_key_1} IN ({users_query})
+                AND end_date IS NULL
+                AND start_date IS NOT NULL
+            ) AS t
+            WHERE t.rn = 1;
+            """
+        )
+    )
+
+
+def refresh_user_stats(
+    connection: Connection,
+    format: str,
+    user_ids: list[int],
+    updated_at: str,
+) -> None:
+    users = ", ".join(str(user_id) for user_id in user_ids)
+    connection.execute(
+        text(f"DELETE FROM user_{format}_stats WHERE user_id IN ({users});")
+    )
+    connection.execute(
+        text(
+            f"""
+            INSERT INTO user_{format}_stats
+            (
+                user_id, abs_score_diff, avg_score_diff, average_popularity,
+                list_size, updated_at
+            )
+            SELECT
+                s.user_id,
+                AVG(CAST(ABS(s.user_score - f.average_score) AS FLOAT)),
+                AVG(CAST(s.user_score - f.average_score AS FLOAT)),
+                AVG(CAST(f.popularity AS FLOAT)),
+                COUNT(*),
+                :updated_at
+            FROM current_user_{format}_score AS s
+            LEFT JOIN {format}_info AS f
+            ON f.{format}_id = s.{format}_id
+            WHERE s.user_id IN ({users})
+            GROUP BY s.user_id;
+            """
+        ),
+        {"updated_at": updated_at},
+    )
+
 
 def upload_many_to_many(
     df: pd.DataFrame,
@@ -82,68 +371,135 @@ def upload_many_to_many(
     insert_date: str,
     engine,
 ) -> None:
-    check_query = f"""
-        SELECT {foreign_key_1}, {foreign_key_2}, {column_1}, start_date, end_date 
-        FROM (
-            SELECT 
-                {foreign_key_1}, {foreign_key_2}, {column_1}, start_date, end_date,
-                ROW_NUMBER() OVER(ORDER BY start_date DESC) AS rn
-            FROM {table_name} 
-            WHERE {foreign_key_1} = {anilist_id}
-        ) AS t
-        WHERE t.rn = 1;
+    # NOTE: Diff mode leaves unchanged rows open with their original start
+    # date, so every open row of the user is closed, not just the latest ones.
+    close_query = f"""
+        UPDATE {table_name}
+        SET end_date = :insert_date
+        WHERE {foreign_key_1} = {anilist_id}
+        AND end_date IS NULL;
     """
 
-    with engine.connect() as connection:
-        check_exists = pd.read_sql(check_query, con=connection)
-
-    if check_exists.empty:
-        with engine.connect() as connection:
-            df.to_sql(
-                name=f"{table_name}",
-                con=connection,
-                if_exists="append",
-                index=False,
+    with engine.begin() as connection:
+        connection.execute(text(close_query), {"insert_date": insert_date})
+        df.to_sql(
+            name=f"{table_name}",
+            con=connection,
+            if_exists="append",
+            index=False,
+        )
+        refresh_current_scores(
+            connection=connection,
+            table_name=table_name,
+            foreign_key_1=foreign_key_1,
+            foreign_key_2=foreign_key_2,
+            column_1=column_1,
+            users_query=str(anilist_id),
+        )
+
+
+def upload_many_to_many_batch(
+    dfs: list[pd.DataFrame],
+    table_name: str,
+    foreign_key_1: str,
+    foreign_key_2: str,
+    column_1: str,
+    insert_date: str,
+    engine,
+    diff: bool = False,
+    staging_suffix: str = "",
+) -> None:
+    df = pd.concat(dfs, ignore_index=True)
+    staging_table = f"{table_name}_staging{staging_suffix}"
+
+    # NOTE: In diff mode only open rows that changed or disappeared are closed,
+    # and only staged rows without an identical open row are inserted.
+    close_filter = ""
+    insert_filter = ""
+    if diff:
+        close_filter = f"""
+            AND NOT EXISTS (
+                SELECT 1 FROM {staging_table} AS staged
+                WHERE staged.{foreign_key_1} = {table_name}.{foreign_key_1}
+                AND staged.{foreign_key_2} = {table_name}.{foreign_key_2}
+                AND staged.{column_1} = {table_name}.{column_1}
             )
-    else:
-        old_start_date = check_exists.loc[0, "start_date"]
-
-        if old_start_date != None:
-            query = f"""
-                UPDATE user_anime_score 
-                SET end_date = '{insert_date}'
-                WHERE user_id = {anilist_id}
-                AND start_date = '{old_start_date}';
-            """
-        else:
-            query = f"""
-                UPDATE user_anime_score
-                SET end_date = '{insert_date}'
-                WHERE user_id = {anilist_id}
-                AND start_date IS NULL;
-            """
+        """
+        insert_filter = f"""
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {table_name} AS existing
+                WHERE existing.{foreign_key_1} = staged.{foreign_key_1}
+                AND existing.{foreign_key_2} = staged.{foreign_key_2}
+                AND existing.{column_1} = staged.{column_1}
+                AND existing.end_date IS NULL
+            )
+        """
+
+    close_query = f"""
+        UPDATE {table_name}
+        SET end_date = :insert_date
+        FROM (SELECT DISTINCT {foreign_key_1} FROM {staging_table}) AS source
+        WHERE {table_name}.{foreign_key_1} = source.{foreign_key_1}
+        AND {table_name}.end_date IS NULL
+        {close_filter};
+    """
+    insert_query = f"""
+        INSERT INTO {table_name}
+        ({foreign_key_1}, {foreign_key_2}, {column_1}, start_date, end_date)
+        SELECT {foreign_key_1}, {foreign_key_2}, {column_1}, :insert_date, NULL
+        FROM {staging_table} AS staged
+        {insert_filter};
+    """
+
+    with transaction(engine) as connection:
+        df[[foreign_key_1, foreign_key_2, column_1]].to_sql(
+            staging_table, con=connection, if_exists="replace", index=False
+        )
+        connection.execute(text(close_query), {"insert_date": insert_date})
+        connection.execute(text(insert_query), {"insert_date": insert_date})
+        refresh_current_scores(
+            connection=connection,
+            table_name=table_name,
+            foreign_key_1=foreign_key_1,
+            foreign_key_2=foreign_key_2,
+            column_1=column_1,
+            users_query=f"SELECT DISTINCT {foreign_key_1} FROM {staging_table}",
+        )
+        connection.execute(text(f"DROP TABLE {staging_table};"))
+
+
+def completed_users(engine: Engine, ingest_date: str) -> pd.Series:
+    query = f"""
+        SELECT user_id, last_modified
+        FROM ingest_checkpoint
+        WHERE ingest_date = '{ingest_date}';
+    """
+    with engine.connect() as connection:
+        checkpoints = pd.read_sql(query, con=connection)
+    # NOTE: parse_dates leaves an empty result as object, which cannot be
+    # compared with the blob timestamps.
+    checkpoints["last_modified"] = pd.to_datetime(checkpoints["last_modified"])
+    return checkpoints.set_index("user_id")["last_modified"]
 
-        with engine.connect() as connection:
-            try:
-                connection.execute(text(query))
-                connection.commit()
-            except DataError:
-                old_start_date = check_exists.loc[0, "start_date"].strftime(
-                    "%Y-%m-%d %H:%M:%S.%f"
-                )[:-3]
-                query = f"""
-                    UPDATE user_anime_score 
-                    SET end_date = '{insert_date}'
-                    WHERE user_id = {anilist_id}
-                    AND start_date = '{old_start_date}';
+
+def record_checkpoint(
+    user_info: pd.DataFrame, ingest_date: str, loaded_at: str, engine
+) -> None:
+    user_ids = ", ".join(str(user_id) for user_id in user_info["user_id"])
+    checkpoints = user_info[["user_id", "last_modified"]].assign(
+        ingest_date=ingest_date, loaded_at=loaded_at
+    )
+
+    with transaction(engine) as connection:
+        connection.execute(
+            text(
+                f"""
+                DELETE FROM ingest_checkpoint
+                WHERE ingest_date = '{ingest_date}'
+                AND user_id IN ({user_ids});
                 """
-                connection.execute(text(query))
-                connection.commit()
-
-        with engine.connect() as connection:
-            df.to_sql(
-                name=f"{table_name}",
-                con=connection,
-                if_exists="append",
-                index=False,
             )
+        )
+        checkpoints.to_sql(
+            "ingest_checkpoint", con=connection, if_exists="append", index=False
+        )
@@ -0,0 +1,55 @@
+import os
+import shutil
+import time
+
+import pandas as pd
+from dagster import ConfigurableIOManager, InputContext, OutputContext
+
+
+class LocalParquetIOManager(ConfigurableIOManager):
+    base_dir: str
+    # NOTE: Stored partitions are only needed to retry or re-run the stages
+    # after raw_blobs, so any not written for retention_days are deleted.
+    retention_days: float = 7
+
+    def _prune(self, context: OutputContext) -> None:
+        asset_dir = os.path.join(self.base_dir, *context.asset_key.path)
+        cutoff = time.time() - self.retention_days * 24 * 60 * 60
+        for entry in os.scandir(asset_dir):
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path)
+
+    def _get_path(self, context: InputContext | OutputContext) -> str:
+        path = os.path.join(self.base_dir, *context.asset_key.path)
+        if context.has_asset_partitions:
+            path = os.path.join(path, context.asset_partition_key)
+        return path
+
+    def handle_output(
+        self, context: OutputContext, obj: pd.DataFrame | dict[str, pd.DataFrame]
+    ) -> None:
+        path = self._get_path(context)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+
+        frames = obj if isinstance(obj, dict) else {"data": obj}
+        for name, df in frames.items():
+            df.to_parquet(os.path.join(path, f"{name}.parquet"), index=False)
+
+        if context.has_asset_partitions:
+            self._prune(context)
+
+    def load_input(
+        self, context: InputContext
+    ) -> pd.DataFrame | dict[str, pd.DataFrame]:
+        path = self._get_path(context)
+        frames = {
+            file_name.removesuffix(".parquet"): pd.read_parquet(
+                os.path.join(path, file_name)
+            )
+            for file_name in sorted(os.listdir(path))
+        }
+        if list(frames) == ["data"]:
+            return frames["data"]
+        return frames
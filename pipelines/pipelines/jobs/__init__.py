@@ -1,8 +1,15 @@
 from dagster import AssetSelection, define_asset_job
 
-upload_data = AssetSelection.assets(["upload_data"])
+upload_data = AssetSelection.assets("upload_data").upstream()
 
 daily_upload_job = define_asset_job(
     name="daily_upload_job",
     selection=upload_data,
 )
+
+stream_upload_data = AssetSelection.assets("stream_upload_data")
+
+streaming_upload_job = define_asset_job(
+    name="streaming_upload_job",
+    selection=stream_upload_data,
+)
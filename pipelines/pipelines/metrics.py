@@ -0,0 +1,63 @@
+import json
+import logging
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+import pandas as pd
+
+
+class StageTimer:
+    def __init__(self, log: logging.Logger | None = None):
+        self.log = log
+        self.stages: dict[str, dict[str, float]] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[dict[str, int]]:
+        volume = {"rows": 0, "bytes": 0}
+        start = time.perf_counter()
+        yield volume
+        seconds = time.perf_counter() - start
+
+        # NOTE: Stages that run once per batch add up into one total.
+        totals = self.stages.setdefault(name, {"seconds": 0.0, "rows": 0, "bytes": 0})
+        totals["seconds"] += seconds
+        totals["rows"] += volume["rows"]
+        totals["bytes"] += volume["bytes"]
+        if self.log is not None:
+            self.log.info(
+                json.dumps({"stage": name, "seconds": round(seconds, 3), **volume})
+            )
+
+    def metadata(self) -> dict[str, float]:
+        return {
+            f"{name}_{key}": round(value, 3) if key == "seconds" else int(value)
+            for name, totals in self.stages.items()
+            for key, value in totals.items()
+        }
+
+
+def frame_rows(frames: dict[str, pd.DataFrame]) -> int:
+    return sum(len(df) for df in frames.values())
+
+
+def frame_bytes(frames: dict[str, pd.DataFrame]) -> int:
+    return int(
+        sum(df.memory_usage(index=False, deep=True).sum() for df in frames.values())
+    )
+
+
+def user_latency_metadata(
+    seconds: pd.Series, stage: str, slowest: int = 5
+) -> dict[str, float | dict]:
+    if seconds.empty:
+        return {}
+
+    return {
+        f"{stage}_p50_seconds": round(float(seconds.quantile(0.5)), 3),
+        f"{stage}_p95_seconds": round(float(seconds.quantile(0.95)), 3),
+        f"{stage}_slowest_users": {
+            str(user_id): round(float(user_seconds), 3)
+            for user_id, user_seconds in seconds.nlargest(slowest).items()
+        },
+    }
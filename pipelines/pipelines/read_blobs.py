@@ -1,6 +1,11 @@
+import ast
+import itertools
 import json
-from io import StringIO
-from typing import Literal
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BufferedReader, BytesIO, RawIOBase, TextIOWrapper
+from typing import BinaryIO, Iterable, Iterator, Literal
 
 import numpy as np
 import pandas as pd
@@ -9,136 +14,238 @@ from azure.storage.blob import BlobServiceClient
 
 def get_blob(
     blob_service_client: BlobServiceClient, container_id: str, blob_name: str
-) -> StringIO:
+) -> bytes:
     blob_client = blob_service_client.get_blob_client(
         container=container_id, blob=blob_name
     )
-    downloader = blob_client.download_blob(max_concurrency=1, encoding="UTF-8")
-    blob_text = downloader.readall()
-    csv = StringIO(f"""{blob_text}""")
-    return csv
+    downloader = blob_client.download_blob(max_concurrency=1)
+    return downloader.readall()
 
 
-def list_to_dict(genre_list: list[str]) -> dict:
-    genre_dict = {}
-    for i, genre in enumerate(genre_list):
-        genre_dict[i] = genre
+class BlobChunkStream(RawIOBase):
+    def __init__(self, chunks: Iterator[bytes]):
+        self.chunks = chunks
+        self.chunk = b""
 
-    return genre_dict
+    def readable(self) -> bool:
+        return True
 
+    def readinto(self, buffer) -> int:
+        while not self.chunk:
+            self.chunk = next(self.chunks, None)
+            if self.chunk is None:
+                return 0
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        return size
 
-def parse_genres(df: pd.DataFrame) -> pd.DataFrame:
-    df["genres"] = df["genres"].apply(eval)
-    df["genres"] = df["genres"].apply(list_to_dict)
-    df["genres"] = df["genres"].apply(json.dumps)
 
-    return df
+def open_blob(
+    blob_service_client: BlobServiceClient, container_id: str, blob_name: str
+) -> BinaryIO:
+    blob_client = blob_service_client.get_blob_client(
+        container=container_id, blob=blob_name
+    )
+    downloader = blob_client.download_blob(max_concurrency=1)
+    return BufferedReader(BlobChunkStream(downloader.chunks()))
 
 
-def process_format_info(
+def download_blobs(
     blob_service_client: BlobServiceClient,
     container_id: str,
-    blobs: list[str],
-    format: Literal["anime", "manga"],
-    position=0,
+    blobs_by_user: dict[int, list[str]],
+    max_workers: int,
+) -> pd.DataFrame:
+    user_ids = [user_id for user_id, blobs in blobs_by_user.items() for _ in blobs]
+    blob_names = [blob for blobs in blobs_by_user.values() for blob in blobs]
+
+    def timed_get_blob(blob_name: str) -> tuple[bytes, float]:
+        start = time.perf_counter()
+        content = get_blob(blob_service_client, container_id, blob_name)
+        return content, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        downloads = list(executor.map(timed_get_blob, blob_names))
+
+    return pd.DataFrame(
+        {
+            "user_id": user_ids,
+            "blob_name": blob_names,
+            "content": [content for content, _ in downloads],
+            "seconds": [seconds for _, seconds in downloads],
+        }
+    )
+
+
+def read_blob_frame(
+    blob_name: str,
+    blob: bytes | BinaryIO,
+    dtype: dict,
+    parse_dates: list[str] | None = None,
 ) -> pd.DataFrame:
-    format_info = get_blob(blob_service_client, container_id, blobs[position])
-    format_info = pd.read_csv(
-        format_info,
+    if isinstance(blob, bytes):
+        blob = BytesIO(blob)
+
+    if blob_name.endswith(".parquet"):
+        # NOTE: Parquet is read from the footer, so streamed blobs are buffered.
+        if not blob.seekable():
+            blob = BytesIO(blob.read())
+        df = pd.read_parquet(blob)
+        return df.astype(dtype)
+
+    # NOTE: CSV blobs from before the Parquet hand-off, kept for backfills.
+    df = pd.read_csv(
+        TextIOWrapper(blob, encoding="UTF-8"),
         sep=",",
+        dtype={"Unnamed: 0": int, **dtype},
+        parse_dates=parse_dates,
+        date_format="%Y-%m-%d %H:%M:%S",
+    )
+    df.drop(labels="Unnamed: 0", axis=1, inplace=True)
+    return df
+
+
+def user_id_from_blob(blob_name: str) -> int:
+    parts = blob_name.split("/")
+    assert (
+        len(parts) == 4 and parts[0] == "data"
+    ), f"Unexpected blob path {blob_name}, expected data/<date>/<user_id>/<file>."
+    return int(parts[2])
+
+
+def select_user_blobs(user_id: int, names: list[str]) -> list[str]:
+    # NOTE: Prefer Parquet if a user re-queried after the CSV hand-off was
+    # replaced on the same day.
+    stems = {name.rsplit(".", 1)[0] for name in names if name.endswith(".parquet")}
+    names = sorted(
+        name
+        for name in names
+        if not (name.endswith(".csv") and name.rsplit(".", 1)[0] in stems)
+    )
+    assert (
+        len(names) == 3 or len(names) == 5
+    ), f"Unexpected number of blobs ({len(names)}) for user {user_id}: {names}"
+
+    return names
+
+
+def group_blobs(blobs: Iterable[dict]) -> dict[int, list[str]]:
+    blobs_by_user: dict[int, list[str]] = {}
+    for blob in blobs:
+        name = blob["name"]
+        blobs_by_user.setdefault(user_id_from_blob(name), []).append(name)
+
+    return {
+        user_id: select_user_blobs(user_id, names)
+        for user_id, names in blobs_by_user.items()
+    }
+
+
+def iter_user_blobs(blobs: Iterable[dict]) -> Iterator[tuple[int, list[str]]]:
+    # NOTE: Blob listings are returned in name order, so every user's blobs are
+    # contiguous and can be grouped without holding the whole listing.
+    names = (blob["name"] for blob in blobs)
+    for user_id, user_names in itertools.groupby(names, key=user_id_from_blob):
+        yield user_id, select_user_blobs(user_id, list(user_names))
+
+
+def genres_to_json(genres: str | tuple[str, ...]) -> str:
+    if isinstance(genres, str):
+        genres = ast.literal_eval(genres)
+    return json.dumps(dict(enumerate(genres)))
+
+
+def parse_genres(df: pd.DataFrame) -> pd.DataFrame:
+    # NOTE: CSV blobs hold each list as a string, Parquet blobs as an array.
+    # The type is decided per row, so missing values in either pass through.
+    genres = df["genres"].map(
+        lambda genre_list: (
+            tuple(genre_list)
+            if isinstance(genre_list, (list, tuple, np.ndarray))
+            else genre_list
+        )
+    )
+
+    # NOTE: Only distinct genre lists are parsed, then broadcast back by code.
+    # The trailing None is picked up by the -1 code pandas gives missing values.
+    codes, uniques = pd.factorize(genres)
+    parsed = np.array([genres_to_json(genre_list) for genre_list in uniques] + [None])
+    df["genres"] = parsed[codes]
+
+    return df
+
+
+def hash_media(format_info: pd.DataFrame) -> pd.Series:
+    media = format_info[["average_score", "title_romaji", "genres", "popularity"]]
+    media = media.astype(
+        {
+            "average_score": "int64",
+            "title_romaji": str,
+            "genres": str,
+            "popularity": "int64",
+        }
+    )
+    hashes = pd.util.hash_pandas_object(media, index=False).to_numpy()
+    return pd.Series(hashes.view("int64"), index=format_info.index)
+
+
+def process_format_info(
+    blob_name: str, blob: bytes | BinaryIO, format: Literal["anime", "manga"]
+) -> pd.DataFrame:
+    format_info = read_blob_frame(
+        blob_name,
+        blob,
         dtype={
-            "Unnamed: 0": int,
             f"{format}_id": int,
             "average_score": int,
-            "genres": pd.StringDtype(),
             "title_romaji": str,
             "popularity": int,
         },
     )
-    format_info.drop(labels="Unnamed: 0", axis=1, inplace=True)
     format_info = parse_genres(format_info)
+    format_info["content_hash"] = hash_media(format_info)
 
     return format_info
 
 
-def process_user_info(
-    blob_service_client: BlobServiceClient,
-    container_id: str,
-    blobs: list[str],
-    position: int,
-) -> pd.DataFrame:
-    user_info = get_blob(blob_service_client, container_id, blobs[position])
-    user_info = pd.read_csv(
-        user_info,
-        sep=",",
+def process_user_info(blob_name: str, blob: bytes | BinaryIO) -> pd.DataFrame:
+    user_info = read_blob_frame(
+        blob_name,
+        blob,
         dtype={
-            "Unnamed: 0": int,
             "user_id": int,
             "user_name": str,
         },
         parse_dates=["request_date"],
-        date_format="%Y-%m-%d %H:%M:%S",
     )
-    user_info.drop(labels="Unnamed: 0", axis=1, inplace=True)
 
     return user_info
 
 
-def process_user_anime_score(
-    blob_service_client: BlobServiceClient,
-    container_id: str,
-    blobs: list[str],
+def process_user_format_score(
+    blob_name: str,
+    blob: bytes | BinaryIO,
     insert_date: str,
-    position: int,
-) -> pd.DataFrame:
-    user_anime_score = get_blob(blob_service_client, container_id, blobs[position])
-    user_anime_score = pd.read_csv(
-        user_anime_score,
-        sep=",",
-        dtype={
-            "Unnamed: 0": int,
-            "user_id": int,
-            "anime_id": int,
-            "user_score": int,
-        },
-    )
-    user_anime_score.drop(labels="Unnamed: 0", axis=1, inplace=True)
-    user_anime_score["start_date"] = insert_date
-    user_anime_score["end_date"] = np.nan
-
-    return user_anime_score
-
-
-def process_user_manga_score(
-    blob_service_client: BlobServiceClient,
-    container_id: str,
-    blobs: list[str],
-    insert_date: str,
-    position: int,
+    format: Literal["anime", "manga"],
 ) -> pd.DataFrame:
-    user_manga_score = get_blob(blob_service_client, container_id, blobs[position])
-    user_manga_score = pd.read_csv(
-        user_manga_score,
-        sep=",",
+    user_format_score = read_blob_frame(
+        blob_name,
+        blob,
         dtype={
-            "Unnamed: 0": int,
             "user_id": int,
-            "manga_id": int,
+            f"{format}_id": int,
             "user_score": int,
         },
     )
-    user_manga_score.drop(labels="Unnamed: 0", axis=1, inplace=True)
-    user_manga_score["start_date"] = insert_date
-    user_manga_score["end_date"] = np.nan
+    user_format_score["start_date"] = insert_date
+    user_format_score["end_date"] = np.nan
 
-    return user_manga_score
+    return user_format_score
 
 
 def read_anime_and_manga(
-    blob_service_client: BlobServiceClient,
-    container_id: str,
-    blobs: list[str],
-    insert_date: str,
+    blobs: dict[str, bytes | BinaryIO], insert_date: str
 ) -> tuple[
     list[pd.DataFrame],
     pd.DataFrame,
@@ -147,22 +254,15 @@ def read_anime_and_manga(
     pd.DataFrame,
     pd.DataFrame,
 ]:
-    anime_info = process_format_info(
-        blob_service_client, container_id, blobs, format="anime"
-    )
-
-    manga_info = process_format_info(
-        blob_service_client, container_id, blobs, position=1, format="manga"
-    )
-
-    user_anime_score = process_user_anime_score(
-        blob_service_client, container_id, blobs, insert_date, position=2
+    names = sorted(blobs)
+    anime_info = process_format_info(names[0], blobs[names[0]], format="anime")
+    manga_info = process_format_info(names[1], blobs[names[1]], format="manga")
+    user_anime_score = process_user_format_score(
+        names[2], blobs[names[2]], insert_date, format="anime"
     )
-
-    user_info = process_user_info(blob_service_client, container_id, blobs, position=3)
-
-    user_manga_score = process_user_manga_score(
-        blob_service_client, container_id, blobs, insert_date, position=4
+    user_info = process_user_info(names[3], blobs[names[3]])
+    user_manga_score = process_user_format_score(
+        names[4], blobs[names[4]], insert_date, format="manga"
     )
 
     dfs = [anime_info, manga_info, user_anime_score, user_info, user_manga_score]
@@ -170,40 +270,154 @@ def read_anime_and_manga(
 
 
 def read_anime(
-    blob_service_client: BlobServiceClient,
-    container_id: str,
-    blobs: list[str],
-    insert_date: str,
+    blobs: dict[str, bytes | BinaryIO], insert_date: str
 ) -> tuple[list[pd.DataFrame], pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-    anime_info = process_format_info(
-        blob_service_client, container_id, blobs, format="anime"
-    )
-
-    user_anime_score = process_user_anime_score(
-        blob_service_client, container_id, blobs, insert_date, position=1
+    names = sorted(blobs)
+    anime_info = process_format_info(names[0], blobs[names[0]], format="anime")
+    user_anime_score = process_user_format_score(
+        names[1], blobs[names[1]], insert_date, format="anime"
     )
-
-    user_info = process_user_info(blob_service_client, container_id, blobs, position=2)
+    user_info = process_user_info(names[2], blobs[names[2]])
 
     dfs = [anime_info, user_anime_score, user_info]
     return dfs, anime_info, user_anime_score, user_info
 
 
 def read_manga(
-    blob_service_client: BlobServiceClient,
-    container_id: str,
-    blobs: list[str],
-    insert_date: str,
+    blobs: dict[str, bytes | BinaryIO], insert_date: str
 ) -> tuple[list[pd.DataFrame], pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-    manga_info = process_format_info(
-        blob_service_client, container_id, blobs, position=0, format="manga"
-    )
-
-    user_info = process_user_info(blob_service_client, container_id, blobs, position=1)
-
-    user_manga_score = process_user_manga_score(
-        blob_service_client, container_id, blobs, insert_date, position=2
+    names = sorted(blobs)
+    manga_info = process_format_info(names[0], blobs[names[0]], format="manga")
+    user_info = process_user_info(names[1], blobs[names[1]])
+    user_manga_score = process_user_format_score(
+        names[2], blobs[names[2]], insert_date, format="manga"
     )
 
     dfs = [manga_info, user_info, user_manga_score]
     return dfs, manga_info, user_info, user_manga_score
+
+
+def read_user(
+    blobs: dict[str, bytes | BinaryIO], insert_date: str
+) -> dict[str, pd.DataFrame]:
+    manga = False
+    for blob in blobs:
+        if "/manga_info." in blob:
+            manga = True
+
+    if len(blobs) == 5:
+        _, anime_info, manga_info, user_anime_score, user_info, user_manga_score = (
+            read_anime_and_manga(blobs=blobs, insert_date=insert_date)
+        )
+        frames = {
+            "anime_info": anime_info,
+            "manga_info": manga_info,
+            "user_info": user_info,
+            "user_anime_score": user_anime_score,
+            "user_manga_score": user_manga_score,
+        }
+    elif not manga:
+        _, anime_info, user_anime_score, user_info = read_anime(
+            blobs=blobs, insert_date=insert_date
+        )
+        frames = {
+            "anime_info": anime_info,
+            "user_info": user_info,
+            "user_anime_score": user_anime_score,
+        }
+    else:
+        _, manga_info, user_info, user_manga_score = read_manga(
+            blobs=blobs, insert_date=insert_date
+        )
+        frames = {
+            "manga_info": manga_info,
+            "user_info": user_info,
+            "user_manga_score": user_manga_score,
+        }
+
+    # NOTE: Info frames are tagged with the user they came from so that the
+    # day's frames can be concatenated and still be split back per user.
+    user_id = int(user_info["user_id"].iloc[0])
+    for format in ["anime", "manga"]:
+        if f"{format}_info" in frames:
+            frames[f"{format}_info"]["user_id"] = user_id
+
+    return frames
+
+
+def parse_blobs(
+    raw_blobs: pd.DataFrame,
+    insert_date: str,
+    max_workers: int,
+    timings: dict[int, float] | None = None,
+) -> dict[str, pd.DataFrame]:
+    users = [
+        (user_id, dict(zip(user_blobs["blob_name"], user_blobs["content"])))
+        for user_id, user_blobs in raw_blobs.groupby("user_id")
+    ]
+
+    def timed_read_user(user_id: int, blobs: dict[str, bytes]) -> dict:
+        start = time.perf_counter()
+        frames = read_user(blobs, insert_date)
+        if timings is not None:
+            timings[user_id] = time.perf_counter() - start
+        return frames
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        parsed = list(executor.map(lambda user: timed_read_user(*user), users))
+
+    return concat_frames(parsed)
+
+
+def concat_frames(batch: list[dict[str, pd.DataFrame]]) -> dict[str, pd.DataFrame]:
+    frames = {}
+    for name in [
+        "anime_info",
+        "manga_info",
+        "user_info",
+        "user_anime_score",
+        "user_manga_score",
+    ]:
+        dfs = [user_frames[name] for user_frames in batch if name in user_frames]
+        if dfs:
+            frames[name] = pd.concat(dfs, ignore_index=True)
+
+    return frames
+
+
+def split_frames(frames: dict[str, pd.DataFrame]) -> dict[int, dict[str, pd.DataFrame]]:
+    frames_by_user: dict[int, dict[str, pd.DataFrame]] = {}
+    for name, df in frames.items():
+        for user_id, user_df in df.groupby("user_id"):
+            frames_by_user.setdefault(int(user_id), {})[name] = user_df.reset_index(
+                drop=True
+            )
+
+    return frames_by_user
+
+
+def stream_frames(
+    blob_service_client: BlobServiceClient,
+    container_id: str,
+    user_blobs: Iterator[tuple[int, list[str]]],
+    insert_date: str,
+    max_workers: int,
+) -> Iterator[dict[str, pd.DataFrame]]:
+    def read_streamed_user(blob_names: list[str]) -> dict[str, pd.DataFrame]:
+        blobs = {
+            blob_name: open_blob(blob_service_client, container_id, blob_name)
+            for blob_name in blob_names
+        }
+        return read_user(blobs=blobs, insert_date=insert_date)
+
+    # NOTE: At most two users per worker are in flight, so memory does not
+    # grow with the number of users in the listing.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = deque()
+        for _, blob_names in user_blobs:
+            in_flight.append(executor.submit(read_streamed_user, blob_names))
+            if len(in_flight) >= 2 * max_workers:
+                yield in_flight.popleft().result()
+
+        while in_flight:
+            yield in_flight.popleft().result()
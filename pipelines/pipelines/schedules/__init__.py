@@ -1,9 +1,22 @@
-from dagster import DefaultScheduleStatus, ScheduleDefinition
+import datetime as dt
+
+from dagster import (
+    DefaultScheduleStatus,
+    RunRequest,
+    ScheduleEvaluationContext,
+    schedule,
+)
 
 from ..jobs import daily_upload_job
 
-daily_upload_schedule = ScheduleDefinition(
+
+@schedule(
     job=daily_upload_job,
     cron_schedule="0 0 * * *",
     default_status=DefaultScheduleStatus.RUNNING,
 )
+def daily_upload_schedule(context: ScheduleEvaluationContext) -> RunRequest:
+    # NOTE: Reconciles the day that just ended, users the blob arrival sensor
+    # already loaded are skipped via their checkpoints.
+    partition_date = context.scheduled_execution_time - dt.timedelta(days=1)
+    return RunRequest(partition_key=partition_date.strftime("%Y-%m-%d"))
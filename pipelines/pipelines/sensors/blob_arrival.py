@@ -0,0 +1,77 @@
+import datetime as dt
+
+from dagster import (
+    DefaultSensorStatus,
+    RunRequest,
+    SensorEvaluationContext,
+    SkipReason,
+    sensor,
+)
+
+from pipelines.funcs import blob_init
+from pipelines.jobs import daily_upload_job
+from pipelines.read_blobs import select_user_blobs, user_id_from_blob
+
+
+def arrived_users(blobs: list[dict], cursor: dt.datetime) -> dict[int, dt.datetime]:
+    blobs_by_user: dict[int, list[dict]] = {}
+    for blob in blobs:
+        blobs_by_user.setdefault(user_id_from_blob(blob["name"]), []).append(blob)
+
+    arrived = {}
+    for user_id, user_blobs in blobs_by_user.items():
+        last_modified = max(blob["last_modified"] for blob in user_blobs)
+        if last_modified <= cursor:
+            continue
+        # NOTE: Users whose upload is still in progress are picked up on a
+        # later tick, their last blob will be newer than the cursor.
+        try:
+            select_user_blobs(user_id, [blob["name"] for blob in user_blobs])
+        except AssertionError:
+            continue
+        arrived[user_id] = last_modified
+
+    return arrived
+
+
+@sensor(
+    job=daily_upload_job,
+    minimum_interval_seconds=300,
+    default_status=DefaultSensorStatus.RUNNING,
+)
+def blob_arrival_sensor(context: SensorEvaluationContext):
+    now = dt.datetime.now(dt.timezone.utc)
+    if context.cursor:
+        cursor = dt.datetime.fromisoformat(context.cursor)
+    else:
+        cursor = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    blob_service_client = blob_init()
+    container_client = blob_service_client.get_container_client("projectanilist")
+
+    # NOTE: Blobs that landed just before midnight are still under the
+    # previous day, so that day is listed too until the cursor passes it.
+    partition_dates = sorted({cursor.strftime("%Y-%m-%d"), now.strftime("%Y-%m-%d")})
+    latest = cursor
+    for partition_date in partition_dates:
+        blobs = list(
+            container_client.list_blobs(name_starts_with=f"data/{partition_date}/")
+        )
+        arrived = arrived_users(blobs, cursor)
+        if not arrived:
+            continue
+
+        batch_latest = max(arrived.values())
+        latest = max(latest, batch_latest)
+        yield RunRequest(
+            run_key=f"{partition_date}-{batch_latest.isoformat()}",
+            partition_key=partition_date,
+            run_config={
+                "ops": {"raw_blobs": {"config": {"user_ids": sorted(arrived)}}}
+            },
+            tags={"ingest": "micro_batch"},
+        )
+
+    if latest == cursor:
+        yield SkipReason("No new users.")
+    context.update_cursor(latest.isoformat())
@@ -1,138 +1,105 @@
 import datetime as dt
-from typing import List
 
 import pandas as pd
 
-
-def check_range(df: pd.DataFrame, column: str) -> AssertionError | None:
-    assert (
-        df[column].max() <= 100
-    ), f"Column {column} in DataFrame {df.name} contains values greater than 100."
+primary_keys = {
+    "anime_info": ["user_id", "anime_id"],
+    "manga_info": ["user_id", "manga_id"],
+    "user_info": ["user_id"],
+    "user_anime_score": ["user_id", "anime_id"],
+    "user_manga_score": ["user_id", "manga_id"],
+}
+
+
+def failed_users(
+    mask: pd.Series, df: pd.DataFrame, table: str, check: str
+) -> pd.DataFrame:
+    failed = df.loc[mask, "user_id"].value_counts(sort=False).rename("rows")
+    return failed.reset_index().assign(table=table, check=check)
+
+
+def validate_frames(frames: dict[str, pd.DataFrame]) -> pd.DataFrame:
+    now = dt.datetime.now()
+    failures = []
+    if "user_info" not in frames:
+        return pd.DataFrame(columns=["user_id", "table", "check", "rows"])
+
+    for table, df in frames.items():
+        checks = {
+            "contains NA values": df.drop(columns="end_date", errors="ignore")
+            .isna()
+            .any(axis=1),
+            "duplicate primary key": df.duplicated(subset=primary_keys[table]),
+        }
+        for column in ["average_score", "user_score"]:
+            if column in df:
+                checks[f"{column} outside 0-100"] = ~df[column].between(0, 100)
+        if "request_date" in df:
+            checks["request_date in the future"] = df["request_date"] >= now
+
+        for check, mask in checks.items():
+            if mask.any():
+                failures.append(failed_users(mask, df, table, check))
+
+    user_ids = pd.Index(frames["user_info"]["user_id"].unique())
+    score_users = pd.Index([])
+    for format in ["anime", "manga"]:
+        info_counts = pd.Series(dtype=int)
+        score_counts = pd.Series(dtype=int)
+        if f"{format}_info" in frames:
+            info_counts = frames[f"{format}_info"]["user_id"].value_counts()
+        if f"user_{format}_score" in frames:
+            score_counts = frames[f"user_{format}_score"]["user_id"].value_counts()
+            score_users = score_users.union(score_counts.index)
+
+        counts = pd.concat(
+            [info_counts.rename("info"), score_counts.rename("score")], axis=1
+        ).fillna(0)
+        mismatched = counts.loc[counts["info"] != counts["score"]]
+        if not mismatched.empty:
+            failures.append(
+                pd.DataFrame(
+                    {
+                        "user_id": mismatched.index,
+                        "rows": (mismatched["info"] - mismatched["score"])
+                        .abs()
+                        .astype(int),
+                        "table": f"{format}_info, user_{format}_score",
+                        "check": "row counts are not equal",
+                    }
+                )
+            )
+
+    all_users = user_ids
+    for df in frames.values():
+        all_users = all_users.union(df["user_id"].unique())
+    for check, missing in [
+        ("missing user_info", all_users.difference(user_ids)),
+        ("no scores", user_ids.difference(score_users)),
+    ]:
+        if not missing.empty:
+            failures.append(
+                pd.DataFrame(
+                    {
+                        "user_id": missing,
+                        "rows": 0,
+                        "table": "user_info",
+                        "check": check,
+                    }
+                )
+            )
+
+    if not failures:
+        return pd.DataFrame(columns=["user_id", "table", "check", "rows"])
+
+    report = pd.concat(failures, ignore_index=True)[
+        ["user_id", "table", "check", "rows"]
+    ]
+    return report.sort_values(by=["user_id", "table", "check"], ignore_index=True)
+
+
+def test_report(report: pd.DataFrame) -> None | AssertionError:
+    failed = list(report["user_id"].unique())
     assert (
-        df[column].max() >= 0
-    ), f"Column {column} in DataFrame {df.name} contains values less than 0."
-
-
-def check_key(df: pd.DataFrame, column: str) -> AssertionError | None:
-    assert len(df[column].unique()) == len(
-        df[column]
-    ), f"Primary key column {column} in {df.name} contains duplicate values."
-
-
-def test_anime(
-    dfs: List[pd.DataFrame],
-    anime_info: pd.DataFrame,
-    user_anime_score: pd.DataFrame,
-    user_info: pd.DataFrame,
-) -> None | AssertionError:
-    anime_info.name = "anime_info"
-    user_anime_score.name = "user_anime_score"
-    user_info.name = "user_info"
-
-    for df in dfs:
-        assert not df.empty, f"{df.name} is empty."
-
-    assert (
-        len(anime_info.index) == len(user_anime_score.index)
-    ), f"Row counts between anime_info and user_anime_score are not equal. anime_info: {len(anime_info.index)}, user_anime_score: {len(user_anime_score.index)}"
-
-    check_range(df=anime_info, column="average_score")
-    check_range(df=user_anime_score, column="user_score")
-
-    check_key(df=anime_info, column="anime_id")
-    check_key(df=user_info, column="user_id")
-    check_key(df=user_anime_score, column="anime_id")
-
-    assert user_info.loc[
-        user_info["request_date"] >= dt.datetime.now()
-    ].empty, "user_info['request_date'] contains dates from the future."
-
-    for df in dfs:
-        for col in df:
-            if col != "end_date":
-                assert bool(
-                    df[f"{col}"].notna().any()
-                ), f"Column {col} in {df.name} contains NA values."
-
-
-def test_manga(
-    dfs: List[pd.DataFrame],
-    manga_info: pd.DataFrame,
-    user_info: pd.DataFrame,
-    user_manga_score: pd.DataFrame,
-) -> None | AssertionError:
-    manga_info.name = "manga_info"
-    user_manga_score.name = "user_manga_score"
-    user_info.name = "user_info"
-
-    for df in dfs:
-        assert not df.empty, f"{df.name} is empty."
-
-    assert len(manga_info.index) == len(
-        user_manga_score.index
-    ), "Row counts between manga_info and user_manga_score are not equal."
-
-    check_range(df=manga_info, column="average_score")
-    check_range(df=user_manga_score, column="user_score")
-
-    check_key(df=manga_info, column="manga_id")
-    check_key(df=user_info, column="user_id")
-    check_key(df=user_manga_score, column="manga_id")
-
-    assert user_info.loc[
-        user_info["request_date"] >= dt.datetime.now()
-    ].empty, "user_info['request_date'] contains dates from the future."
-
-    for df in dfs:
-        for col in df:
-            if col != "end_date":
-                assert bool(
-                    df[f"{col}"].notna().any()
-                ), f"Column {col} in {df.name} contains NA values."
-
-
-def test_anime_and_manga(
-    dfs: List[pd.DataFrame],
-    anime_info: pd.DataFrame,
-    manga_info: pd.DataFrame,
-    user_anime_score: pd.DataFrame,
-    user_info: pd.DataFrame,
-    user_manga_score: pd.DataFrame,
-) -> None | AssertionError:
-    anime_info.name = "anime_info"
-    manga_info.name = "manga_info"
-    user_anime_score.name = "user_anime_score"
-    user_info.name = "user_info"
-    user_manga_score.name = "user_manga_score"
-
-    for df in dfs:
-        assert not df.empty, f"{df.name} is empty."
-
-    assert len(anime_info.index) == len(
-        user_anime_score.index
-    ), "Row counts between anime_info and user_anime_score are not equal."
-    assert len(manga_info.index) == len(
-        user_manga_score.index
-    ), "Row counts between manga_info and user_manga_score are not equal."
-
-    check_range(df=anime_info, column="average_score")
-    check_range(df=user_anime_score, column="user_score")
-    check_range(df=manga_info, column="average_score")
-    check_range(df=user_manga_score, column="user_score")
-
-    check_key(df=anime_info, column="anime_id")
-    check_key(df=user_info, column="user_id")
-    check_key(df=user_anime_score, column="anime_id")
-    check_key(df=manga_info, column="manga_id")
-    check_key(df=user_manga_score, column="manga_id")
-
-    assert user_info.loc[
-        user_info["request_date"] >= dt.datetime.now()
-    ].empty, "user_info['request_date'] contains dates from the future."
-
-    for df in dfs:
-        for col in df:
-            if col != "end_date":
-                assert bool(
-                    df[f"{col}"].notna().any()
-                ), f"Column {col} in {df.name} contains NA values."
+        report.empty
+    ), f"Data quality checks failed for users {failed}:\n{report.to_string()}"
@@ -0,0 +1,295 @@
+import argparse
+import datetime as dt
+import os
+import re
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Literal
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Engine, create_engine
+
+# NOTE: Importing pipelines loads the definitions, which read the email sensor
+# settings, so the benchmark can run without them set.
+os.environ.setdefault("SENDER_EMAIL", "")
+os.environ.setdefault("APP_PASSWORD", "")
+os.environ.setdefault("RECEIVER_EMAIL", "")
+
+from pipelines.assets import merge_batch, write_history
+from pipelines.funcs import MediaCache
+from pipelines.read_blobs import download_blobs, group_blobs, parse_blobs
+from pipelines.tests import validate_frames
+
+CREATE_TABLES = Path(__file__).parents[2] / "sql" / "create_tables.sql"
+STAGES = ["list", "download", "parse", "validate", "merge", "history"]
+GENRES = ["Action", "Comedy", "Drama", "Fantasy", "Romance", "Sci-Fi", "Slice of Life"]
+
+
+class FileDownloader:
+    def __init__(self, path: Path):
+        self.path = path
+
+    def readall(self) -> bytes:
+        return self.path.read_bytes()
+
+    def chunks(self) -> Iterator[bytes]:
+        with open(self.path, "rb") as f:
+            while chunk := f.read(4 * 1024 * 1024):
+                yield chunk
+
+
+class FileBlobClient:
+    def __init__(self, path: Path):
+        self.path = path
+
+    def download_blob(self, max_concurrency: int = 1) -> FileDownloader:
+        return FileDownloader(self.path)
+
+
+class FileContainerClient:
+    def __init__(self, root: Path):
+        self.root = root
+
+    def list_blobs(self, name_starts_with: str = "") -> Iterator[dict]:
+        for path in sorted(self.root.rglob("*")):
+            name = path.relative_to(self.root).as_posix()
+            if path.is_file() and name.startswith(name_starts_with):
+                stat = path.stat()
+                yield {
+                    "name": name,
+                    "size": stat.st_size,
+                    "last_modified": dt.datetime.fromtimestamp(
+                        stat.st_mtime, dt.timezone.utc
+                    ),
+                }
+
+
+class FileBlobServiceClient:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def get_container_client(self, container: str) -> FileContainerClient:
+        return FileContainerClient(self.root / container)
+
+    def get_blob_client(self, container: str, blob: str) -> FileBlobClient:
+        return FileBlobClient(self.root / container / blob)
+
+
+def write_frame(df: pd.DataFrame, path: Path, file_format: str) -> None:
+    # NOTE: The site uploads Parquet, CSV is the format from before the
+    # hand-off and is still read for backfills.
+    if file_format == "parquet":
+        df.to_parquet(path.with_suffix(".parquet"), index=False, compression="zstd")
+    else:
+        if "genres" in df:
+            df = df.assign(genres=df["genres"].map(str))
+        df.to_csv(path.with_suffix(".csv"))
+
+
+def generate_blobs(
+    root: Path,
+    date: str,
+    users: int,
+    media: int = 20_000,
+    seed: int = 0,
+    file_format: Literal["parquet", "csv"] = "parquet",
+) -> None:
+    rng = np.random.default_rng(seed)
+    titles = np.array([f"Title {i}" for i in range(media)], dtype=object)
+    genres = np.empty(media, dtype=object)
+    genres[:] = [
+        rng.choice(GENRES, rng.integers(1, 4), replace=False).tolist()
+        for _ in range(media)
+    ]
+    average_scores = rng.integers(40, 90, media)
+    popularity = rng.zipf(1.5, media).clip(max=1_000_000)
+
+    # NOTE: Media ids are drawn with a skew towards low ids, so users share
+    # popular titles the way real lists do.
+    for user_id in range(1, users + 1):
+        user_dir = root / "projectanilist" / "data" / date / str(user_id)
+        user_dir.mkdir(parents=True, exist_ok=True)
+
+        formats = ["anime", "manga"] if rng.random() < 0.5 else ["anime"]
+        for format in formats:
+            size = int(np.clip(rng.lognormal(4.5, 0.8), 1, 2_000))
+            ids = np.unique((rng.pareto(1.2, size) * 100).astype(int) % media)
+            format_info = pd.DataFrame(
+                {
+                    f"{format}_id": ids + 1,
+                    "average_score": average_scores[ids],
+                    "title_romaji": titles[ids],
+                    "genres": genres[ids],
+                    "popularity": popularity[ids],
+                }
+            )
+            write_frame(format_info, user_dir / f"{format}_info", file_format)
+            user_score = pd.DataFrame(
+                {
+                    "user_score": rng.integers(0, 101, len(ids)),
+                    f"{format}_id": ids + 1,
+                    "user_id": user_id,
+                }
+            )
+            write_frame(user_score, user_dir / f"user_{format}_score", file_format)
+
+        user_info = pd.DataFrame(
+            {
+                "user_id": [user_id],
+                "user_name": [f"user{user_id}"],
+                "request_date": pd.to_datetime([f"{date} 12:00:00"]),
+            }
+        )
+        write_frame(user_info, user_dir / "user_info", file_format)
+
+
+def sqlite_engine(path: Path) -> Engine:
+    engine = create_engine(f"sqlite:///{path}")
+    ddl = CREATE_TABLES.read_text().replace(
+        "INT IDENTITY(1,1) PRIMARY KEY", "INTEGER PRIMARY KEY AUTOINCREMENT"
+    )
+    # NOTE: SQLite has no covering indexes, the key columns are kept.
+    ddl = re.sub(r"\s+INCLUDE \([^)]*\)", "", ddl)
+    connection = engine.raw_connection()
+    try:
+        connection.executescript(ddl)
+    finally:
+        connection.close()
+    return engine
+
+
+@contextmanager
+def measure(stage: str, results: dict) -> Iterator[None]:
+    tracemalloc.reset_peak()
+    start_memory, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    yield
+    _, peak_memory = tracemalloc.get_traced_memory()
+    results[stage] = {
+        "seconds": time.perf_counter() - start,
+        "peak_mb": (peak_memory - start_memory) / 1024 / 1024,
+    }
+
+
+def run_benchmark(
+    blob_service_client: FileBlobServiceClient,
+    engine: Engine,
+    date: str,
+    max_workers: int = 8,
+    batch_size: int = 1000,
+    trace_memory: bool = True,
+) -> dict[str, dict[str, float]]:
+    container_id = "projectanilist"
+    container_client = blob_service_client.get_container_client(container_id)
+    insert_date = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    results = {}
+
+    # NOTE: tracemalloc slows allocation heavy stages such as parse down
+    # noticeably, turn it off to compare timings only.
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with measure("list", results):
+            blobs_by_user = group_blobs(
+                container_client.list_blobs(name_starts_with=f"data/{date}/")
+            )
+
+        with measure("download", results):
+            raw_blobs = download_blobs(
+                blob_service_client=blob_service_client,
+                container_id=container_id,
+                blobs_by_user=blobs_by_user,
+                max_workers=max_workers,
+            )
+
+        with measure("parse", results):
+            frames = parse_blobs(
+                raw_blobs=raw_blobs, insert_date=insert_date, max_workers=max_workers
+            )
+        del raw_blobs
+
+        with measure("validate", results):
+            report = validate_frames(frames)
+        assert report.empty, report.to_string()
+
+        user_ids = frames["user_info"]["user_id"].unique()
+        batches = [
+            {
+                name: df.loc[df["user_id"].isin(user_ids[i : i + batch_size])]
+                for name, df in frames.items()
+            }
+            for i in range(0, len(user_ids), batch_size)
+        ]
+
+        with measure("merge", results):
+            media_cache = MediaCache(engine)
+            for batch in batches:
+                merge_batch(frames=batch, engine=engine, media_cache=media_cache)
+
+        with measure("history", results):
+            for batch in batches:
+                write_history(
+                    frames=batch,
+                    insert_date=insert_date,
+                    engine=engine,
+                    diff_history=True,
+                )
+    finally:
+        tracemalloc.stop()
+
+    return results
+
+
+def sweep(
+    users: list[int],
+    max_workers: int,
+    batch_size: int,
+    trace_memory: bool,
+    file_format: Literal["parquet", "csv"] = "parquet",
+) -> pd.DataFrame:
+    date = "2024-08-01"
+    rows = []
+    for n in users:
+        with tempfile.TemporaryDirectory() as tmp:
+            generate_blobs(
+                Path(tmp) / "blobs", date=date, users=n, file_format=file_format
+            )
+            engine = sqlite_engine(Path(tmp) / "benchmark.db")
+            results = run_benchmark(
+                FileBlobServiceClient(Path(tmp) / "blobs"),
+                engine,
+                date=date,
+                max_workers=max_workers,
+                batch_size=batch_size,
+                trace_memory=trace_memory,
+            )
+            engine.dispose()
+
+        for stage, result in results.items():
+            rows.append({"users": n, "stage": stage, **result})
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--no-memory", action="store_true")
+    parser.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    args = parser.parse_args()
+
+    report = sweep(
+        args.users,
+        args.max_workers,
+        args.batch_size,
+        not args.no_memory,
+        file_format=args.format,
+    )
+    report = report.pivot(index="stage", columns="users").reindex(STAGES)
+    print(report.round(3).to_string())
@@ -0,0 +1,5 @@
+import os
+
+os.environ.setdefault("SENDER_EMAIL", "")
+os.environ.setdefault("APP_PASSWORD", "")
+os.environ.setdefault("RECEIVER_EMAIL", "")
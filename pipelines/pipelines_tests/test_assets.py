@@ -1 +1,203 @@
+import json
 
+import pandas as pd
+import pytest
+from dagster import build_asset_context
+
+from pipelines import assets, db
+from pipelines.assets import UploadDataConfig
+from pipelines_tests.benchmark import (
+    FileBlobServiceClient,
+    generate_blobs,
+    run_benchmark,
+    sqlite_engine,
+)
+
+
+@pytest.mark.parametrize("file_format", ["parquet", "csv"])
+def test_benchmark_loads_every_user(tmp_path, file_format):
+    generate_blobs(
+        tmp_path / "blobs", date="2024-08-01", users=10, file_format=file_format
+    )
+    engine = sqlite_engine(tmp_path / "benchmark.db")
+    blob_service_client = FileBlobServiceClient(tmp_path / "blobs")
+
+    results = run_benchmark(blob_service_client, engine, date="2024-08-01")
+    assert list(results) == [
+        "list",
+        "download",
+        "parse",
+        "validate",
+        "merge",
+        "history",
+    ]
+
+    with engine.connect() as connection:
+        users = pd.read_sql("SELECT COUNT(*) AS n FROM user_info;", con=connection)
+        open_scores = pd.read_sql(
+            "SELECT COUNT(*) AS n FROM user_anime_score WHERE end_date IS NULL;",
+            con=connection,
+        )
+    assert users["n"].iloc[0] == 10
+
+    # NOTE: Loading the same day again leaves the open history untouched.
+    run_benchmark(blob_service_client, engine, date="2024-08-01")
+    with engine.connect() as connection:
+        rerun_scores = pd.read_sql(
+            "SELECT COUNT(*) AS n FROM user_anime_score;", con=connection
+        )
+    assert rerun_scores["n"].iloc[0] == open_scores["n"].iloc[0]
+
+    with engine.connect() as connection:
+        current_scores = pd.read_sql(
+            "SELECT COUNT(*) AS n FROM current_user_anime_score;", con=connection
+        )
+    assert current_scores["n"].iloc[0] == open_scores["n"].iloc[0]
+
+    with engine.connect() as connection:
+        stats = pd.read_sql(
+            "SELECT * FROM user_anime_stats ORDER BY user_id;", con=connection
+        )
+        scores = pd.read_sql(
+            """
+            SELECT s.user_id, s.user_score - f.average_score AS diff
+            FROM current_user_anime_score AS s
+            JOIN anime_info AS f ON f.anime_id = s.anime_id;
+            """,
+            con=connection,
+        )
+    expected = scores.groupby("user_id")["diff"].agg(["mean", "size"])
+    assert stats["avg_score_diff"].tolist() == pytest.approx(expected["mean"].tolist())
+    assert stats["list_size"].tolist() == expected["size"].tolist()
+
+    with engine.connect() as connection:
+        anime_info = pd.read_sql("SELECT anime_id, genres FROM anime_info;", connection)
+        media_genre = pd.read_sql(
+            """
+            SELECT media_genre.media_id, genre.genre_name
+            FROM media_genre
+            INNER JOIN genre ON genre.genre_id = media_genre.genre_id
+            WHERE media_genre.format = 'anime';
+            """,
+            con=connection,
+        )
+    genres = anime_info["genres"].map(
+        lambda genres: sorted(json.loads(genres).values())
+    )
+    bridged = media_genre.groupby("media_id")["genre_name"].agg(sorted)
+    assert bridged.to_dict() == dict(zip(anime_info["anime_id"], genres))
+    engine.dispose()
+
+
+def load_day(tmp_path, monkeypatch, config: UploadDataConfig) -> None:
+    monkeypatch.setattr(
+        assets, "blob_init", lambda: FileBlobServiceClient(tmp_path / "blobs")
+    )
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'pipeline.db'}")
+
+    def context():
+        return build_asset_context(partition_key="2024-08-01")
+
+    raw_blobs = assets.raw_blobs(context(), assets.RawBlobsConfig())
+    parsed_frames = assets.parsed_frames(context(), assets.PoolConfig(), raw_blobs)
+    validated_frames = assets.validated_frames(
+        context(), assets.ValidationConfig(), parsed_frames
+    )
+    assets.upload_data(context(), config, validated_frames)
+
+
+def test_upload_data_resumes_from_checkpoints(tmp_path, monkeypatch):
+    generate_blobs(tmp_path / "blobs", date="2024-08-01", users=5, media=200)
+    sqlite_engine(tmp_path / "pipeline.db").dispose()
+    db.dispose_engine()
+
+    # NOTE: The first attempt at a partition has no checkpoints to compare to.
+    load_day(tmp_path, monkeypatch, UploadDataConfig(resume=True))
+    engine = db.get_engine()
+    with engine.connect() as connection:
+        first = pd.read_sql(
+            "SELECT user_id, loaded_at FROM ingest_checkpoint ORDER BY user_id;",
+            con=connection,
+        )
+    assert first["user_id"].tolist() == [1, 2, 3, 4, 5]
+
+    load_day(tmp_path, monkeypatch, UploadDataConfig(resume=True))
+    with engine.connect() as connection:
+        second = pd.read_sql(
+            "SELECT user_id, loaded_at FROM ingest_checkpoint ORDER BY user_id;",
+            con=connection,
+        )
+    assert second.equals(first)
+    db.dispose_engine()
+
+
+def test_stream_upload_data_writes_checkpoints(tmp_path, monkeypatch):
+    generate_blobs(tmp_path / "blobs", date="2024-08-01", users=5, media=200)
+    sqlite_engine(tmp_path / "pipeline.db").dispose()
+    db.dispose_engine()
+    monkeypatch.setattr(
+        assets, "blob_init", lambda: FileBlobServiceClient(tmp_path / "blobs")
+    )
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'pipeline.db'}")
+    config = assets.StreamUploadConfig(batch_size=2)
+
+    assets.stream_upload_data(build_asset_context(partition_key="2024-08-01"), config)
+    engine = db.get_engine()
+    with engine.connect() as connection:
+        first = pd.read_sql(
+            "SELECT user_id, loaded_at FROM ingest_checkpoint ORDER BY user_id;",
+            con=connection,
+        )
+    assert first["user_id"].tolist() == [1, 2, 3, 4, 5]
+
+    # NOTE: A retry of the partition skips every user it already loaded.
+    assets.stream_upload_data(build_asset_context(partition_key="2024-08-01"), config)
+    with engine.connect() as connection:
+        second = pd.read_sql(
+            "SELECT user_id, loaded_at FROM ingest_checkpoint ORDER BY user_id;",
+            con=connection,
+        )
+    assert second.equals(first)
+    db.dispose_engine()
+
+
+def test_upload_data_per_user_drops_partition_staging(tmp_path, monkeypatch):
+    generate_blobs(tmp_path / "blobs", date="2024-08-01", users=3, media=200)
+    sqlite_engine(tmp_path / "pipeline.db").dispose()
+    db.dispose_engine()
+
+    staged = []
+    to_sql = pd.DataFrame.to_sql
+
+    def record_to_sql(df, name, *args, **kwargs):
+        staged.append(name)
+        return to_sql(df, name, *args, **kwargs)
+
+    monkeypatch.setattr(pd.DataFrame, "to_sql", record_to_sql)
+    load_day(tmp_path, monkeypatch, UploadDataConfig(batch_load=False))
+
+    # NOTE: Partitions run concurrently, so every staging table is suffixed
+    # with the partition date and dropped once merged.
+    staging = {name for name in staged if "temp" in name or "staging" in name}
+    assert staging == {"temp_table_20240801", "media_genre_staging_20240801"}
+    with db.get_engine().connect() as connection:
+        tables = pd.read_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'table';", con=connection
+        )
+        users = pd.read_sql("SELECT COUNT(*) AS n FROM user_info;", con=connection)
+    assert not set(tables["name"]) & staging
+    assert users["n"].iloc[0] == 3
+    db.dispose_engine()
+
+
+def test_upload_data_skips_empty_partition(tmp_path, monkeypatch):
+    (tmp_path / "blobs" / "projectanilist").mkdir(parents=True)
+    sqlite_engine(tmp_path / "pipeline.db").dispose()
+    db.dispose_engine()
+
+    load_day(tmp_path, monkeypatch, UploadDataConfig())
+
+    with db.get_engine().connect() as connection:
+        users = pd.read_sql("SELECT COUNT(*) AS n FROM user_info;", con=connection)
+    assert users["n"].iloc[0] == 0
+    db.dispose_engine()
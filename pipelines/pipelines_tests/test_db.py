@@ -0,0 +1,17 @@
+from sqlalchemy import text
+
+from pipelines import db
+
+
+def test_get_engine_reuses_pool(monkeypatch, tmp_path):
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'test.db'}")
+    db.dispose_engine()
+
+    engine = db.get_engine()
+    assert db.get_engine() is engine
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT 1")).scalar() == 1
+
+    db.dispose_engine()
+    assert db.get_engine() is not engine
+    db.dispose_engine()
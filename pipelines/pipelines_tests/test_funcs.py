@@ -0,0 +1,318 @@
+import pandas as pd
+
+from pipelines.funcs import (
+    MediaCache,
+    completed_users,
+    record_checkpoint,
+    refresh_current_scores,
+    refresh_user_stats,
+    upload_batch,
+    upload_many_to_many,
+    upload_many_to_many_batch,
+)
+from pipelines_tests.benchmark import sqlite_engine
+
+
+def test_record_checkpoint_keeps_latest_upload(tmp_path):
+    engine = sqlite_engine(tmp_path / "checkpoint.db")
+    user_info = pd.DataFrame(
+        {
+            "user_id": [1, 2],
+            "last_modified": pd.to_datetime(["2024-08-01 10:00", "2024-08-01 11:00"]),
+        }
+    )
+    record_checkpoint(user_info, "2024-08-01", "2024-08-02 00:00:00.000", engine)
+
+    user_info.loc[1, "last_modified"] = pd.Timestamp("2024-08-01 15:00")
+    record_checkpoint(
+        user_info.iloc[[1]], "2024-08-01", "2024-08-02 00:05:00.000", engine
+    )
+
+    checkpoints = completed_users(engine, "2024-08-01")
+    assert checkpoints.sort_index().to_dict() == {
+        1: pd.Timestamp("2024-08-01 10:00"),
+        2: pd.Timestamp("2024-08-01 15:00"),
+    }
+    assert completed_users(engine, "2024-08-02").empty
+    engine.dispose()
+
+
+def scores(user_scores: dict[int, int], start_date: str) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "user_score": list(user_scores.values()),
+            "anime_id": list(user_scores),
+            "user_id": 1,
+            "start_date": start_date,
+            "end_date": None,
+        }
+    )
+
+
+def write_scores(engine, user_scores: dict[int, int], insert_date: str) -> None:
+    upload_many_to_many_batch(
+        dfs=[scores(user_scores, insert_date)],
+        table_name="user_anime_score",
+        foreign_key_1="user_id",
+        foreign_key_2="anime_id",
+        column_1="user_score",
+        insert_date=insert_date,
+        engine=engine,
+        diff=True,
+    )
+
+
+def read_history(engine) -> pd.DataFrame:
+    with engine.connect() as connection:
+        history = pd.read_sql(
+            """
+            SELECT anime_id, user_score, start_date, end_date
+            FROM user_anime_score
+            ORDER BY anime_id, start_date;
+            """,
+            con=connection,
+        )
+    history["end_date"] = history["end_date"].astype(object)
+    return history.where(history.notna(), None)
+
+
+def test_diff_history_closes_changed_and_removed_scores(tmp_path):
+    engine = sqlite_engine(tmp_path / "history.db")
+    day_1 = "2024-08-01 00:00:00.000"
+    day_2 = "2024-08-02 00:00:00.000"
+    write_scores(engine, {1: 80, 2: 70, 3: 60}, day_1)
+    write_scores(engine, {1: 80, 2: 75, 4: 90}, day_2)
+
+    history = read_history(engine)
+    assert history.to_dict(orient="records") == [
+        # NOTE: Unchanged, left open with its first start date.
+        {"anime_id": 1, "user_score": 80, "start_date": day_1, "end_date": None},
+        # NOTE: Changed, the old score is closed and the new one opened.
+        {"anime_id": 2, "user_score": 70, "start_date": day_1, "end_date": day_2},
+        {"anime_id": 2, "user_score": 75, "start_date": day_2, "end_date": None},
+        # NOTE: Removed from the list, closed.
+        {"anime_id": 3, "user_score": 60, "start_date": day_1, "end_date": day_2},
+        {"anime_id": 4, "user_score": 90, "start_date": day_2, "end_date": None},
+    ]
+    engine.dispose()
+
+
+def test_per_user_history_closes_rows_left_open_by_diff(tmp_path):
+    engine = sqlite_engine(tmp_path / "history.db")
+    write_scores(engine, {1: 80, 2: 70, 3: 60}, "2024-08-01 00:00:00.000")
+    write_scores(engine, {1: 80, 2: 75, 3: 60}, "2024-08-02 00:00:00.000")
+
+    day_3 = "2024-08-03 00:00:00.000"
+    upload_many_to_many(
+        df=scores({1: 85, 2: 75, 3: 60}, day_3),
+        table_name="user_anime_score",
+        foreign_key_1="user_id",
+        foreign_key_2="anime_id",
+        column_1="user_score",
+        anilist_id=1,
+        insert_date=day_3,
+        engine=engine,
+    )
+
+    history = read_history(engine)
+    open_rows = history.loc[history["end_date"].isna()]
+    assert open_rows["anime_id"].tolist() == [1, 2, 3]
+    assert (open_rows["start_date"] == day_3).all()
+    with engine.connect() as connection:
+        current = pd.read_sql(
+            "SELECT anime_id, user_score FROM current_user_anime_score;",
+            con=connection,
+        )
+    assert current.sort_values("anime_id")["user_score"].tolist() == [85, 75, 60]
+    engine.dispose()
+
+
+def test_refresh_current_scores_replaces_user_rows(tmp_path):
+    engine = sqlite_engine(tmp_path / "current.db")
+    history = pd.DataFrame(
+        {
+            "user_id": [1, 1, 1, 1, 2],
+            "anime_id": [1, 1, 2, 3, 1],
+            "user_score": [70, 80, 60, 50, 90],
+            "start_date": ["2024-08-01", "2024-08-02"] + ["2024-08-01"] * 3,
+            "end_date": ["2024-08-02", None, None, "2024-08-02", None],
+        }
+    )
+    current = pd.DataFrame(
+        {
+            "user_id": [1, 1, 2],
+            "anime_id": [1, 3, 1],
+            "user_score": [70, 50, 40],
+            "start_date": ["2024-08-01"] * 3,
+        }
+    )
+    with engine.begin() as connection:
+        history.to_sql(
+            "user_anime_score", con=connection, if_exists="append", index=False
+        )
+        current.to_sql(
+            "current_user_anime_score", con=connection, if_exists="append", index=False
+        )
+        refresh_current_scores(
+            connection=connection,
+            table_name="user_anime_score",
+            foreign_key_1="user_id",
+            foreign_key_2="anime_id",
+            column_1="user_score",
+            users_query="1",
+        )
+
+    with engine.connect() as connection:
+        refreshed = pd.read_sql(
+            """
+            SELECT user_id, anime_id, user_score
+            FROM current_user_anime_score
+            ORDER BY user_id, anime_id;
+            """,
+            con=connection,
+        )
+    # NOTE: User 1 now has only their open rows, user 2 is left as it was.
+    assert refreshed.values.tolist() == [[1, 1, 80], [1, 2, 60], [2, 1, 40]]
+    engine.dispose()
+
+
+def test_refresh_user_stats_only_updates_given_users(tmp_path):
+    engine = sqlite_engine(tmp_path / "stats.db")
+    anime_info = pd.DataFrame(
+        {
+            "anime_id": [1, 2],
+            "average_score": [70, 50],
+            "title_romaji": ["A", "B"],
+            "genres": ["{}", "{}"],
+            "popularity": [100, 300],
+        }
+    )
+    current = pd.DataFrame(
+        {
+            "user_id": [1, 1, 2],
+            "anime_id": [1, 2, 1],
+            "user_score": [80, 40, 90],
+            "start_date": ["2024-08-01"] * 3,
+        }
+    )
+    stale = pd.DataFrame(
+        {
+            "user_id": [1, 2],
+            "abs_score_diff": [0.0, 0.0],
+            "avg_score_diff": [0.0, 0.0],
+            "average_popularity": [0.0, 0.0],
+            "list_size": [0, 0],
+            "updated_at": ["2024-08-01 00:00:00.000"] * 2,
+        }
+    )
+    with engine.begin() as connection:
+        anime_info.to_sql("anime_info", con=connection, if_exists="append", index=False)
+        current.to_sql(
+            "current_user_anime_score", con=connection, if_exists="append", index=False
+        )
+        stale.to_sql(
+            "user_anime_stats", con=connection, if_exists="append", index=False
+        )
+        refresh_user_stats(
+            connection=connection,
+            format="anime",
+            user_ids=[1],
+            updated_at="2024-08-02 00:00:00.000",
+        )
+
+    with engine.connect() as connection:
+        stats = pd.read_sql(
+            "SELECT * FROM user_anime_stats ORDER BY user_id;", con=connection
+        )
+    assert stats.iloc[0].to_dict() == {
+        "user_id": 1,
+        "abs_score_diff": 10.0,
+        "avg_score_diff": 0.0,
+        "average_popularity": 200.0,
+        "list_size": 2,
+        "updated_at": "2024-08-02 00:00:00.000",
+    }
+    assert stats.iloc[1].to_dict() == stale.iloc[1].to_dict()
+    engine.dispose()
+
+
+def test_upload_batch_replaces_changed_genre_links(tmp_path):
+    engine = sqlite_engine(tmp_path / "genres.db")
+
+    def upload_anime(genres: list[str]) -> None:
+        anime_info = pd.DataFrame(
+            {
+                "anime_id": [1, 2],
+                "average_score": [70, 50],
+                "title_romaji": ["A", "B"],
+                "genres": genres,
+                "popularity": [100, 300],
+                "content_hash": [1, 2],
+            }
+        )
+        upload_batch(
+            dfs=[anime_info],
+            table_name="anime_info",
+            primary_key="anime_id",
+            column_1="average_score",
+            column_2="title_romaji",
+            engine=engine,
+        )
+
+    upload_anime(['{"0": "Action", "1": "Drama"}', '{"0": "Action"}'])
+    upload_anime(['{"0": "Comedy"}', '{"0": "Action"}'])
+
+    with engine.connect() as connection:
+        media_genre = pd.read_sql(
+            """
+            SELECT media_genre.media_id, genre.genre_name
+            FROM media_genre
+            INNER JOIN genre ON genre.genre_id = media_genre.genre_id
+            ORDER BY media_genre.media_id, genre.genre_name;
+            """,
+            con=connection,
+        )
+        genres = pd.read_sql("SELECT genre_name FROM genre;", con=connection)
+    assert media_genre.values.tolist() == [[1, "Comedy"], [2, "Action"]]
+    assert sorted(genres["genre_name"]) == ["Action", "Comedy", "Drama"]
+    engine.dispose()
+
+
+def test_media_cache_skips_unchanged_media(tmp_path):
+    engine = sqlite_engine(tmp_path / "media.db")
+    media_cache = MediaCache(engine)
+
+    def upload_anime(titles: list[str], hashes: list[int]) -> None:
+        anime_info = pd.DataFrame(
+            {
+                "anime_id": [1, 2],
+                "average_score": [70, 50],
+                "title_romaji": titles,
+                "genres": ['{"0": "Action"}'] * 2,
+                "popularity": [100, 300],
+                "content_hash": hashes,
+            }
+        )
+        upload_batch(
+            dfs=[anime_info],
+            table_name="anime_info",
+            primary_key="anime_id",
+            column_1="average_score",
+            column_2="title_romaji",
+            engine=engine,
+            media_cache=media_cache,
+        )
+
+    upload_anime(["A", "B"], [1, 2])
+    # NOTE: The title of anime 1 differs but its hash does not, so the row is
+    # taken to be unchanged and is not written.
+    upload_anime(["A2", "B2"], [1, 3])
+
+    with engine.connect() as connection:
+        anime_info = pd.read_sql(
+            "SELECT anime_id, title_romaji FROM anime_info ORDER BY anime_id;",
+            con=connection,
+        )
+    assert anime_info["title_romaji"].tolist() == ["A", "B2"]
+    assert media_cache.hashes["anime_info"].sort_index().to_dict() == {1: 1, 2: 3}
+    engine.dispose()
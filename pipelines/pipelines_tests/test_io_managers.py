@@ -0,0 +1,29 @@
+import os
+import time
+
+import pandas as pd
+from dagster import AssetKey, build_output_context
+
+from pipelines.assets import daily_partitions
+from pipelines.io_managers import LocalParquetIOManager
+
+
+def test_partitions_older_than_retention_are_deleted(tmp_path):
+    io_manager = LocalParquetIOManager(base_dir=str(tmp_path), retention_days=7)
+    df = pd.DataFrame({"user_id": [1]})
+
+    def write(partition_key: str) -> None:
+        context = build_output_context(
+            asset_key=AssetKey("raw_blobs"),
+            partition_key=partition_key,
+            asset_partitions_def=daily_partitions,
+        )
+        io_manager.handle_output(context, df)
+
+    write("2024-08-01")
+    write("2024-08-05")
+    old = time.time() - 8 * 24 * 60 * 60
+    os.utime(tmp_path / "raw_blobs" / "2024-08-01", (old, old))
+
+    write("2024-08-10")
+    assert sorted(os.listdir(tmp_path / "raw_blobs")) == ["2024-08-05", "2024-08-10"]
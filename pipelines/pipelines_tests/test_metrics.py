@@ -0,0 +1,26 @@
+import pandas as pd
+
+from pipelines.metrics import StageTimer, user_latency_metadata
+
+
+def test_stage_timer_sums_batches():
+    timer = StageTimer()
+    for rows in [10, 20]:
+        with timer.stage("merge") as volume:
+            volume["rows"] = rows
+            volume["bytes"] = rows * 8
+
+    metadata = timer.metadata()
+    assert metadata["merge_rows"] == 30
+    assert metadata["merge_bytes"] == 240
+    assert metadata["merge_seconds"] >= 0
+
+
+def test_user_latency_metadata_names_slowest_users():
+    seconds = pd.Series({user_id: user_id / 100 for user_id in range(1, 101)})
+    metadata = user_latency_metadata(seconds, "download", slowest=2)
+
+    assert metadata["download_p50_seconds"] == 0.505
+    assert metadata["download_p95_seconds"] == 0.95
+    assert metadata["download_slowest_users"] == {"100": 1.0, "99": 0.99}
+    assert user_latency_metadata(pd.Series(dtype=float), "download") == {}
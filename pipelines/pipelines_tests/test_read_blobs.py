@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipelines.read_blobs import group_blobs, iter_user_blobs, parse_genres
+
+
+def blob_list(user_id: int, manga: bool = False) -> list[dict]:
+    names = ["anime_info.csv", "user_anime_score.csv", "user_info.csv"]
+    if manga:
+        names += ["manga_info.csv", "user_manga_score.csv"]
+    return [{"name": f"data/2024-01-01/{user_id}/{name}"} for name in names]
+
+
+def test_group_blobs_by_path():
+    blobs = blob_list(123) + blob_list(51234, manga=True) + blob_list(1234)
+    blobs_by_user = group_blobs(iter(blobs))
+
+    assert sorted(blobs_by_user) == [123, 1234, 51234]
+    assert blobs_by_user[123] == [
+        "data/2024-01-01/123/anime_info.csv",
+        "data/2024-01-01/123/user_anime_score.csv",
+        "data/2024-01-01/123/user_info.csv",
+    ]
+    assert len(blobs_by_user[51234]) == 5
+
+
+def test_group_blobs_incomplete_user():
+    with pytest.raises(AssertionError, match="user 123"):
+        group_blobs(blob_list(123)[:2])
+
+
+def test_parse_genres_matches_stored_json():
+    genres = [["Action", "Sci-Fi"], [], ["Slice of Life"], ["Action", "Sci-Fi"]]
+    expected = [
+        '{"0": "Action", "1": "Sci-Fi"}',
+        "{}",
+        '{"0": "Slice of Life"}',
+        '{"0": "Action", "1": "Sci-Fi"}',
+    ]
+
+    csv_genres = pd.DataFrame(
+        {"genres": pd.array([str(g) for g in genres], dtype="string")}
+    )
+    parquet_genres = pd.DataFrame({"genres": [np.array(g) for g in genres]})
+
+    assert parse_genres(csv_genres)["genres"].tolist() == expected
+    assert parse_genres(parquet_genres)["genres"].tolist() == expected
+
+
+def test_parse_genres_with_missing_first_row():
+    csv_genres = pd.DataFrame(
+        {"genres": pd.array([None, "['Action']", "[]"], dtype="string")}
+    )
+    parquet_genres = pd.DataFrame(
+        {"genres": [None, np.array(["Action"]), np.array([], dtype=object)]}
+    )
+
+    for df in [csv_genres, parquet_genres]:
+        genres = parse_genres(df)["genres"].tolist()
+        assert pd.isna(genres[0])
+        assert genres[1:] == ['{"0": "Action"}', "{}"]
+
+
+def test_iter_user_blobs_streams_contiguous_users():
+    blobs = iter(blob_list(123) + blob_list(1234, manga=True))
+    user_blobs = iter_user_blobs(blobs)
+
+    user_id, names = next(user_blobs)
+    assert user_id == 123 and len(names) == 3
+    assert next(blobs)["name"].startswith("data/2024-01-01/1234/")
@@ -0,0 +1,27 @@
+import datetime as dt
+
+from pipelines.sensors.blob_arrival import arrived_users
+
+cursor = dt.datetime(2024, 8, 1, 12, tzinfo=dt.timezone.utc)
+
+
+def user_blobs(user_id: int, names: list[str], minutes: int) -> list[dict]:
+    return [
+        {
+            "name": f"data/2024-08-01/{user_id}/{name}",
+            "last_modified": cursor + dt.timedelta(minutes=minutes),
+        }
+        for name in names
+    ]
+
+
+def test_arrived_users_skips_old_and_incomplete_users():
+    anime = ["anime_info.csv", "user_anime_score.csv", "user_info.csv"]
+    blobs = (
+        user_blobs(1, anime, minutes=-5)
+        + user_blobs(2, anime, minutes=3)
+        + user_blobs(3, anime[:2], minutes=4)
+        + user_blobs(4, anime + ["manga_info.csv"], minutes=5)
+    )
+
+    assert arrived_users(blobs, cursor) == {2: cursor + dt.timedelta(minutes=3)}
@@ -0,0 +1,63 @@
+import datetime as dt
+
+import pandas as pd
+
+from pipelines.tests import validate_frames
+
+
+def user_frames(user_id: int, scores: list[int]) -> dict[str, pd.DataFrame]:
+    anime_ids = list(range(1, len(scores) + 1))
+    return {
+        "anime_info": pd.DataFrame(
+            {
+                "anime_id": anime_ids,
+                "average_score": 70,
+                "title_romaji": "Title",
+                "genres": "{}",
+                "popularity": 100,
+                "user_id": user_id,
+            }
+        ),
+        "user_info": pd.DataFrame(
+            {
+                "user_id": [user_id],
+                "user_name": ["name"],
+                "request_date": [dt.datetime(2024, 1, 1)],
+            }
+        ),
+        "user_anime_score": pd.DataFrame(
+            {
+                "user_score": scores,
+                "anime_id": anime_ids,
+                "user_id": user_id,
+                "start_date": "2024-01-02 00:00:00.000",
+                "end_date": None,
+            }
+        ),
+    }
+
+
+def concat(*users: dict[str, pd.DataFrame]) -> dict[str, pd.DataFrame]:
+    return {
+        name: pd.concat([frames[name] for frames in users], ignore_index=True)
+        for name in users[0]
+    }
+
+
+def test_validate_frames_passes_clean_batch():
+    report = validate_frames(concat(user_frames(1, [50, 60]), user_frames(2, [70])))
+
+    assert report.empty
+
+
+def test_validate_frames_names_offending_users():
+    bad_score = user_frames(2, [50, 150])
+    missing_row = user_frames(3, [50, 60])
+    missing_row["user_anime_score"] = missing_row["user_anime_score"].iloc[:1]
+
+    report = validate_frames(concat(user_frames(1, [50]), bad_score, missing_row))
+
+    assert report[["user_id", "check"]].values.tolist() == [
+        [2, "user_score outside 0-100"],
+        [3, "row counts are not equal"],
+    ]
@@ -9,6 +9,7 @@ setup(
         "SQLAlchemy",
         "pyodbc",
         "pandas",
+        "pyarrow",
         "azure-storage-blob",
         "python-dotenv",
     ],
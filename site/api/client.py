@@ -0,0 +1,43 @@
+import importlib.util
+import os
+import threading
+
+import httpx
+
+client_lock = threading.Lock()
+client: httpx.Client | None = None
+
+
+def create_client() -> httpx.Client:
+    # NOTE: ANILIST_URL points the site at another server, e.g. a local mock
+    # of the GraphQL API for tests.
+    base_url = os.getenv("ANILIST_URL", "https://graphql.anilist.co")
+    http2 = os.getenv("ANILIST_HTTP2", "true").lower() == "true"
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("ANILIST_MAX_CONNECTIONS", "20")),
+        max_keepalive_connections=int(os.getenv("ANILIST_MAX_KEEPALIVE", "10")),
+        keepalive_expiry=float(os.getenv("ANILIST_KEEPALIVE_EXPIRY", "60")),
+    )
+
+    return httpx.Client(
+        base_url=base_url,
+        http2=http2 and importlib.util.find_spec("h2") is not None,
+        limits=limits,
+        timeout=10,
+    )
+
+
+def get_client() -> httpx.Client:
+    global client
+    with client_lock:
+        if client is None:
+            client = create_client()
+    return client
+
+
+def close_client() -> None:
+    global client
+    with client_lock:
+        if client is not None:
+            client.close()
+            client = None
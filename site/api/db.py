@@ -0,0 +1,51 @@
+import os
+import threading
+from urllib.parse import quote_plus
+
+from sqlalchemy import Engine, create_engine
+from sqlalchemy.engine import URL, make_url
+
+engine_lock = threading.Lock()
+engine: Engine | None = None
+
+
+def engine_url() -> URL:
+    # NOTE: DATABASE_URL points the site at another database, e.g. a local
+    # SQLite file for tests and benchmarks.
+    if "DATABASE_URL" in os.environ:
+        return make_url(os.environ["DATABASE_URL"])
+
+    connection_string = os.environ["AZURE_ODBC"]
+    return URL.create(
+        "mssql+pyodbc", query={"odbc_connect": quote_plus(connection_string)}
+    )
+
+
+def create_pooled_engine(url: URL) -> Engine:
+    options = {
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    }
+    if url.get_backend_name() != "sqlite":
+        options["pool_size"] = int(os.getenv("DB_POOL_SIZE", "5"))
+        options["max_overflow"] = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    if url.get_backend_name() == "mssql":
+        options["fast_executemany"] = True
+
+    return create_engine(url, **options)
+
+
+def get_engine() -> Engine:
+    global engine
+    with engine_lock:
+        if engine is None:
+            engine = create_pooled_engine(engine_url())
+    return engine
+
+
+def dispose_engine() -> None:
+    global engine
+    with engine_lock:
+        if engine is not None:
+            engine.dispose()
+            engine = None
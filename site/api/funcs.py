@@ -1,8 +1,9 @@
+import asyncio
 import os
 
-import aiohttp
 import pandas as pd
-import requests
+
+from api.client import get_client
 
 
 def load_query(file_name: str) -> str:
@@ -12,20 +13,14 @@ def load_query(file_name: str) -> str:
 
 
 def fetch_anilist_data(query: str, variables: dict) -> tuple[dict, pd.Series]:
-    url = "https://graphql.anilist.co"
-    response = requests.post(
-        url, json={"query": query, "variables": variables}, timeout=10
-    )
+    response = get_client().post("", json={"query": query, "variables": variables})
     response.raise_for_status()
     response_header = pd.Series(response.headers["Date"])
     return response.json(), response_header
 
 
 async def fetch_anilist_data_async(query: str, variables: dict) -> dict:
-    url = "https://graphql.anilist.co"
-    async with aiohttp.ClientSession(raise_for_status=True) as session:
-        async with session.post(
-            url,
-            json={"query": query, "variables": variables},
-        ) as response:
-            return await response.json()
+    # NOTE: Runs on the shared client in a worker thread, so pages reuse the
+    # pooled connections instead of opening a session each.
+    json_response, _ = await asyncio.to_thread(fetch_anilist_data, query, variables)
+    return json_response
@@ -2,8 +2,6 @@ from typing import Literal
 
 import pandas as pd
 
-from api.funcs import fetch_anilist_data, load_query
-
 
 def genre_insights(
     merged_dfs: pd.DataFrame,
@@ -110,19 +108,9 @@ def general_insights(
     title_max = max_diff["title_romaji"].iloc[0]
     title_min = min_diff["title_romaji"].iloc[0]
 
-    image_id_1 = int(max_diff[f"{format}_id"].iloc[0])
-    image_id_2 = int(min_diff[f"{format}_id"].iloc[0])
-    image_id_3 = int(genre_fav[f"{format}_id"].iloc[0])
-    query_image = load_query("image.gql")
-    variables_image_1 = {"id": image_id_1}
-    variables_image_2 = {"id": image_id_2}
-    variables_image_3 = {"id": image_id_3}
-    cover_image_1, _ = fetch_anilist_data(query_image, variables_image_1)
-    cover_image_2, _ = fetch_anilist_data(query_image, variables_image_2)
-    cover_image_3, _ = fetch_anilist_data(query_image, variables_image_3)
-    cover_image_1 = cover_image_1["data"]["Media"]["coverImage"]["extraLarge"]
-    cover_image_2 = cover_image_2["data"]["Media"]["coverImage"]["extraLarge"]
-    cover_image_3 = cover_image_3["data"]["Media"]["coverImage"]["extraLarge"]
+    cover_image_1 = max_diff["cover_image"].iloc[0]
+    cover_image_2 = min_diff["cover_image"].iloc[0]
+    cover_image_3 = genre_fav["cover_image"].iloc[0]
 
     return (
         abs_score_diff,
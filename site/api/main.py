@@ -9,7 +9,6 @@ from api.processing import (
     create_plot_data,
     create_table,
     get_format_info,
-    get_id,
     get_user_data,
     round_scores,
 )
@@ -22,12 +21,8 @@ def fetch_data(username: str, format: Literal["anime", "manga"]):
     # format = "anime"
 
     # NOTE: Processing
-    anilist_id = get_id(username=username)
-    user_score, user_info, id_list = get_user_data(
-        username=username,
-        anilist_id=anilist_id,
-        format=format,
-    )
+    user_score, user_info, id_list = get_user_data(username=username, format=format)
+    anilist_id = int(user_info["user_id"].iloc[0])
     format_info = get_format_info(username=username, id_list=id_list, format=format)
     format_info, user_score = check_nulls(
         format_info=format_info, user_score=user_score, format=format
@@ -71,7 +66,7 @@ def fetch_data(username: str, format: Literal["anime", "manga"]):
     plot_json = create_plot_data(df=merged_dfs, fill_df=new_rows)
 
     # NOTE: Upload
-    dfs = [format_info, user_info, user_score]
+    dfs = [format_info.drop(columns="cover_image"), user_info, user_score]
     names = [f"{format}_info", "user_info", f"user_{format}_score"]
     blob_upload(dfs=dfs, names=names, anilist_id=anilist_id)
 
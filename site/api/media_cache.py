@@ -0,0 +1,134 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Literal
+
+cache_lock = threading.Lock()
+connection: sqlite3.Connection | None = None
+counters = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+
+def create_connection() -> sqlite3.Connection:
+    # NOTE: MEDIA_CACHE_PATH moves the cache file, e.g. onto a volume so it
+    # survives container rebuilds.
+    path = os.getenv("MEDIA_CACHE_PATH", "./api/media_cache.db")
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL;")
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS media (
+            format TEXT NOT NULL,
+            media_id INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (format, media_id)
+        );
+        """
+    )
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS ix_media_last_used ON media (last_used);"
+    )
+    return connection
+
+
+def get_connection() -> sqlite3.Connection:
+    global connection
+    if connection is None:
+        with cache_lock:
+            if connection is None:
+                connection = create_connection()
+    return connection
+
+
+def close_cache() -> None:
+    global connection
+    with cache_lock:
+        if connection is not None:
+            connection.close()
+            connection = None
+
+
+def get_media(
+    format: Literal["anime", "manga"], id_list: list[int]
+) -> tuple[list[dict], list[int]]:
+    ttl = float(os.getenv("MEDIA_CACHE_TTL", "86400"))
+    now = time.time()
+    connection = get_connection()
+
+    # NOTE: The ids are passed as one JSON array, so long lists don't run into
+    # SQLite's bound parameter limit.
+    with cache_lock, connection:
+        rows = connection.execute(
+            """
+            SELECT media_id, data, fetched_at FROM media
+            WHERE format = ? AND media_id IN (SELECT value FROM json_each(?));
+            """,
+            (format, json.dumps(id_list)),
+        ).fetchall()
+
+        fresh = {
+            media_id: data
+            for media_id, data, fetched_at in rows
+            if now - fetched_at < ttl
+        }
+        connection.execute(
+            """
+            UPDATE media SET last_used = ?
+            WHERE format = ? AND media_id IN (SELECT value FROM json_each(?));
+            """,
+            (now, format, json.dumps(list(fresh))),
+        )
+
+        missing = [media_id for media_id in id_list if media_id not in fresh]
+        counters["hits"] += len(fresh)
+        counters["misses"] += len(missing)
+        counters["expired"] += len(rows) - len(fresh)
+
+    return [json.loads(data) for data in fresh.values()], missing
+
+
+def put_media(format: Literal["anime", "manga"], media: list[dict]) -> None:
+    max_rows = int(os.getenv("MEDIA_CACHE_MAX_ROWS", "50000"))
+    now = time.time()
+    connection = get_connection()
+
+    with cache_lock, connection:
+        connection.executemany(
+            """
+            INSERT INTO media (format, media_id, data, fetched_at, last_used)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (format, media_id) DO UPDATE SET
+                data = excluded.data,
+                fetched_at = excluded.fetched_at,
+                last_used = excluded.last_used;
+            """,
+            [(format, item["id"], json.dumps(item), now, now) for item in media],
+        )
+
+        # NOTE: Once the cache is over its size bound, the least recently used
+        # titles are dropped, whatever their format.
+        evicted = connection.execute(
+            """
+            DELETE FROM media WHERE rowid IN (
+                SELECT rowid FROM media ORDER BY last_used
+                LIMIT max((SELECT count(*) FROM media) - ?, 0)
+            );
+            """,
+            (max_rows,),
+        ).rowcount
+        counters["evictions"] += evicted
+
+
+def cache_stats() -> dict:
+    connection = get_connection()
+    with cache_lock:
+        rows = connection.execute("SELECT count(*) FROM media;").fetchone()[0]
+        stats = dict(counters)
+
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+    stats["rows"] = rows
+    return stats
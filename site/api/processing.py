@@ -2,48 +2,29 @@ import asyncio
 import datetime as dt
 import os
 from typing import Literal
-from urllib.parse import quote_plus
 
+import httpx
 import pandas as pd
-import requests.exceptions
-from sqlalchemy import create_engine
 
+from api.db import get_engine
 from api.funcs import fetch_anilist_data, fetch_anilist_data_async, load_query
-
-
-def get_id(username: str) -> int:
-    query_get_id = load_query("get_id.gql")
-    variables_get_id = {"name": username}
-    json_response = None
-    try:
-        json_response, _ = fetch_anilist_data(query_get_id, variables_get_id)
-    except requests.exceptions.HTTPError as e:
-        if e.response.status_code == 404:
-            raise ValueError(f"Username {username} not found.")
-        if e.response.status_code == 429:
-            raise ValueError(
-                "Oops! AniList is a bit overloaded at the moment, please try again later."
-            )
-
-    if json_response is None:
-        raise ValueError(f"Failed to fetch data for {username}.")
-
-    anilist_id = json_response["data"]["User"]["id"]
-
-    return anilist_id
+from api.media_cache import get_media, put_media
 
 
 def get_user_data(
-    username: str, anilist_id: int, format: Literal["anime", "manga"]
+    username: str, format: Literal["anime", "manga"]
 ) -> tuple[pd.DataFrame, pd.DataFrame, list[int]]:
     json_response = None
     response_header = None
     query_user = load_query(f"{format}_user.gql")
 
-    variables_user = {"page": 1, "id": anilist_id}
+    # NOTE: The user is resolved by name in the same request as their scores.
+    variables_user = {"name": username}
     try:
         json_response, response_header = fetch_anilist_data(query_user, variables_user)
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 404:
+            raise ValueError(f"Username {username} not found.")
         if e.response.status_code == 429:
             raise ValueError(
                 "Oops! AniList is a bit overloaded at the moment, please try again later."
@@ -54,8 +35,8 @@ def get_user_data(
 
     user_score = pd.json_normalize(
         json_response,
-        record_path=["data", "Page", "users", "statistics", f"{format}", "scores"],
-        meta=[["data", "Page", "users", "id"]],
+        record_path=["data", "User", "statistics", f"{format}", "scores"],
+        meta=[["data", "User", "id"]],
     )
 
     if user_score.empty:
@@ -67,7 +48,7 @@ def get_user_data(
     user_score.rename(
         columns={
             "mediaIds": f"{format}_id",
-            "data.Page.users.id": "user_id",
+            "data.User.id": "user_id",
             "score": "user_score",
         },
         inplace=True,
@@ -79,7 +60,7 @@ def get_user_data(
         pass
 
     # NOTE: Make user info table
-    user_info = pd.json_normalize(json_response, record_path=["data", "Page", "users"])
+    user_info = pd.json_normalize(json_response["data"]["User"])
     user_info.drop(f"statistics.{format}.scores", axis=1, inplace=True)
 
     user_info = pd.concat([user_info, response_header], axis=1)
@@ -98,45 +79,69 @@ def get_user_data(
 def get_format_info(
     username: str, id_list: list[int], format: Literal["anime", "manga"]
 ) -> pd.DataFrame:
-    async def main():
+    # NOTE: AniList caps pages at 50 media, so the ids are split into page
+    # sized chunks up front and fetched concurrently.
+    page_size = 50
+    max_concurrency = int(os.getenv("ANILIST_CONCURRENCY", "4"))
+    query_format = load_query("media.gql")
+
+    # NOTE: Only titles that are missing from the media cache, or have expired,
+    # are requested from AniList.
+    cached_media, missing_ids = get_media(format, list(dict.fromkeys(id_list)))
+    id_chunks = [
+        missing_ids[i : i + page_size] for i in range(0, len(missing_ids), page_size)
+    ]
+
+    async def fetch_chunk(id_chunk: list[int], semaphore: asyncio.Semaphore) -> dict:
         response_ids = None
-        format_info = pd.DataFrame()
+        variables_format = {"page": 1, "perPage": page_size, "id_in": id_chunk}
 
-        variables_format = {"page": 1, "id_in": id_list}
-        query_format = load_query("media.gql")
-
-        while True:
+        async with semaphore:
             try:
                 response_ids = await fetch_anilist_data_async(
                     query_format, variables_format
                 )
-            except requests.exceptions.HTTPError as e:
+            except httpx.HTTPStatusError as e:
                 if e.response.status_code == 429:
                     raise ValueError(
                         "Oops! AniList is a bit overloaded at the moment, please try again later."
                     )
 
-            if response_ids == None:
-                raise ValueError(f"Failed to fetch data for {username}.")
+        if response_ids == None:
+            raise ValueError(f"Failed to fetch data for {username}.")
 
-            page_df = pd.json_normalize(
-                response_ids, record_path=["data", "Page", "media"]
-            )
-            format_info = pd.concat([format_info, page_df], ignore_index=True)
+        return response_ids
 
-            if not response_ids["data"]["Page"]["pageInfo"]["hasNextPage"]:
-                break
-
-            variables_format["page"] += 1
-
-        return format_info
+    async def main():
+        semaphore = asyncio.Semaphore(max_concurrency)
+        responses = await asyncio.gather(
+            *[fetch_chunk(id_chunk, semaphore) for id_chunk in id_chunks]
+        )
 
-    format_info = asyncio.run(main())
+        return [
+            media
+            for response_ids in responses
+            for media in response_ids["data"]["Page"]["media"]
+        ]
+
+    fetched_media = asyncio.run(main())
+    put_media(format, fetched_media)
+
+    # NOTE: Cached and fetched titles are put back in the order of id_list.
+    media_by_id = {media["id"]: media for media in cached_media + fetched_media}
+    format_info = pd.json_normalize(
+        [
+            media_by_id[media_id]
+            for media_id in dict.fromkeys(id_list)
+            if media_id in media_by_id
+        ]
+    )
 
     format_info.rename(
         columns={
             "averageScore": "average_score",
             "title.romaji": "title_romaji",
+            "coverImage.extraLarge": "cover_image",
             "id": f"{format}_id",
         },
         inplace=True,
@@ -150,9 +155,11 @@ def check_nulls(
     user_score: pd.DataFrame,
     format: Literal["anime", "manga"],
 ) -> tuple[pd.DataFrame, pd.DataFrame]:
-    null_ids = list(format_info.loc[format_info.isna().any(axis=1)][f"{format}_id"])
+    # NOTE: A missing cover only blanks an image, the title itself is usable.
+    null_rows = format_info.drop(columns="cover_image").isna().any(axis=1)
+    null_ids = list(format_info.loc[null_rows][f"{format}_id"])
     if len(null_ids) > 0:
-        format_info.dropna(axis=0, inplace=True)
+        format_info = format_info.loc[~null_rows]
         user_score = user_score[~user_score[f"{format}_id"].isin(null_ids)]
     format_info = format_info.astype({"average_score": int})
 
@@ -245,10 +252,8 @@ def create_genre_data(genre_df: pd.DataFrame) -> list[dict]:
     return genre_dict
 
 
-def create_abs_avg_plot_data(
-    format: Literal["anime", "manga"], abs_score_diff: float, avg_score_diff: float
-) -> tuple[list[dict], list[dict]]:
-    existing_data_path = f"./api/existing_{format}_data.parquet"
+def load_user_stats(format: Literal["anime", "manga"]) -> pd.DataFrame:
+    existing_data_path = f"./api/existing_{format}_stats.parquet"
     file_exists = os.path.isfile(existing_data_path)
 
     if file_exists:
@@ -259,48 +264,26 @@ def create_abs_avg_plot_data(
         last_queried = dt.timedelta(days=0)
 
     if (not file_exists) or (last_queried >= dt.timedelta(days=1)):
-        connection_string = os.environ["AZURE_ODBC"]
-        connection_url = (
-            f"mssql+pyodbc:///?odbc_connect={quote_plus(connection_string)}"
-        )
-        engine = create_engine(connection_url)
+        engine = get_engine()
 
+        # NOTE: The pipeline keeps one row of aggregates per user, see
+        # refresh_user_stats.
         with engine.connect() as connection:
             query = f"""
-                SELECT {format}_id, user_score, user_id
-                FROM user_{format}_score
-                WHERE end_date IS NULL 
-                AND start_date IS NOT NULL;
+                SELECT user_id, abs_score_diff, avg_score_diff, average_popularity
+                FROM user_{format}_stats;
             """
-            existing_user_score = pd.read_sql(sql=query, con=connection)
+            user_stats = pd.read_sql(sql=query, con=connection)
+            user_stats.to_parquet(existing_data_path)
 
-            query = f"""
-                SELECT {format}_id, average_score
-                FROM {format}_info;
-            """
-            existing_format_info = pd.read_sql(sql=query, con=connection)
+    return pd.read_parquet(existing_data_path)
 
-            existing_merged_dfs = existing_user_score.merge(
-                existing_format_info, on=f"{format}_id", how="left"
-            )
-            existing_merged_dfs.to_parquet(existing_data_path)
 
+def create_abs_avg_plot_data(
+    format: Literal["anime", "manga"], abs_score_diff: float, avg_score_diff: float
+) -> tuple[list[dict], list[dict]]:
     def diff_buckets(df: pd.DataFrame, calc_type: Literal["abs", "avg"]) -> list[dict]:
-        df["score_diff"] = df["user_score"] - df["average_score"]
-
-        if calc_type == "abs":
-            df[f"{calc_type}_score_diff"] = (
-                df["user_score"] - df["average_score"]
-            ).abs()
-        else:
-            df[f"{calc_type}_score_diff"] = df["user_score"] - df["average_score"]
-
-        agg_data = df.groupby(by="user_id", as_index=False).agg(
-            {f"{calc_type}_score_diff": "mean"}
-        )
-        agg_data[f"{calc_type}_score_diff"] = (
-            agg_data[f"{calc_type}_score_diff"].round().astype(int)
-        )
+        agg_data = df[[f"{calc_type}_score_diff"]].dropna().round().astype(int)
         agg_data = pd.DataFrame(
             agg_data.value_counts(f"{calc_type}_score_diff", sort=False)
         ).reset_index()
@@ -317,7 +300,7 @@ def create_abs_avg_plot_data(
 
         return agg_data
 
-    existing_user_df = pd.read_parquet(existing_data_path)
+    existing_user_df = load_user_stats(format=format)
 
     abs_data = diff_buckets(df=existing_user_df, calc_type="abs")
     avg_data = diff_buckets(df=existing_user_df, calc_type="avg")
@@ -328,40 +311,15 @@ def create_abs_avg_plot_data(
 def create_obscurity_data(
     format: Literal["anime", "manga"], format_df: pd.DataFrame
 ) -> tuple[list[dict], int]:
-    existing_data_path = f"./api/existing_{format}_pop_data.parquet"
-    file_exists = os.path.isfile(existing_data_path)
     user_pop = int(round(format_df["popularity"].mean()))
 
-    if file_exists:
-        last_queried = dt.datetime.now() - dt.datetime.fromtimestamp(
-            os.path.getmtime(existing_data_path)
-        )
-    else:
-        last_queried = dt.timedelta(days=0)
-
-    if (not file_exists) or (last_queried >= dt.timedelta(days=1)):
-        connection_string = os.environ["AZURE_ODBC"]
-        connection_url = (
-            f"mssql+pyodbc:///?odbc_connect={quote_plus(connection_string)}"
-        )
-        engine = create_engine(connection_url)
-
-        with engine.connect() as connection:
-            query = f"""
-                SELECT AVG(f.popularity) AS average_popularity
-                FROM {format}_info AS f
-                LEFT JOIN user_{format}_score uf
-                ON f.{format}_id = uf.{format}_id
-                WHERE uf.end_date IS NULL
-                AND uf.start_date IS NOT NULL
-                AND f.popularity IS NOT NULL
-                GROUP BY user_id;
-            """
-            pop_df = pd.read_sql(sql=query, con=connection)
-
-            pop_df.to_parquet(existing_data_path)
-
-    existing_df = pd.read_parquet(existing_data_path)
+    # NOTE: Truncated like the integer AVG the population query used to return.
+    existing_df = (
+        load_user_stats(format=format)[["average_popularity"]]
+        .dropna()
+        .astype(int)
+        .reset_index(drop=True)
+    )
 
     if user_pop not in existing_df["average_popularity"].values:
         existing_df.loc[len(existing_df)] = user_pop
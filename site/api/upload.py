@@ -1,5 +1,7 @@
 import os
 from datetime import datetime as dt
+from datetime import timezone
+from io import BytesIO
 from typing import List
 
 import pandas as pd
@@ -13,17 +15,16 @@ def blob_upload(dfs: List[pd.DataFrame], names: List[str], anilist_id: int) -> N
     )
     container_id = "projectanilist"
 
-    date = dt.today().strftime("%Y-%m-%d")
+    # NOTE: Blob folders are named by UTC date, the day the pipeline's
+    # partitions and blob arrival sensor use.
+    date = dt.now(timezone.utc).strftime("%Y-%m-%d")
     for i, df in enumerate(dfs):
         name = names[i]
-        file_path = os.path.join("./api/", f"{name}.csv")
-        df.to_csv(path_or_buf=file_path)
+        parquet = BytesIO()
+        df.to_parquet(path=parquet, index=False, compression="zstd")
 
-        blob_path = f"data/{date}/{anilist_id}/{name}.csv"
+        blob_path = f"data/{date}/{anilist_id}/{name}.parquet"
         blob_object = blob_service_client.get_blob_client(
             container=container_id, blob=blob_path
         )
-
-        with open(file_path, mode="rb") as csv:
-            blob_object.upload_blob(csv, overwrite=True)
-            os.remove(file_path)
+        blob_object.upload_blob(parquet.getvalue(), overwrite=True)
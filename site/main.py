@@ -1,13 +1,16 @@
 import sys
 from contextlib import asynccontextmanager
 
+from api.client import close_client, get_client
+from api.db import dispose_engine
 from api.main import fetch_data
+from api.media_cache import cache_stats, close_cache
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.inmemory import InMemoryBackend
 from fastapi_cache.decorator import cache
-from requests.exceptions import HTTPError
+from httpx import HTTPStatusError
 
 context = str(sys.argv)
 
@@ -15,7 +18,11 @@ context = str(sys.argv)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     FastAPICache.init(InMemoryBackend())
+    get_client()
     yield
+    close_client()
+    close_cache()
+    dispose_engine()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -47,10 +54,15 @@ def process_preferences(username: str, manga: bool):
                 else fetch_data(username=username, format="anime")
             )
             return {"insights": insights}
-        except ValueError or HTTPError as e:
+        except ValueError or HTTPStatusError as e:
             raise HTTPException(status_code=404, detail=f"{e}")
     else:
         raise HTTPException(
             status_code=404,
             detail=f"Username '{username}' has an invalid length (<2 or >20 characters).",
         )
+
+
+@app.get("/metrics/media-cache/")
+def media_cache_metrics():
+    return cache_stats()
@@ -0,0 +1,39 @@
+import json
+
+import httpx
+from api import client
+from api.funcs import fetch_anilist_data
+
+
+def test_client_is_shared_and_uses_anilist_url(monkeypatch):
+    monkeypatch.setenv("ANILIST_URL", "http://anilist.test")
+    client.close_client()
+
+    shared = client.get_client()
+    assert client.get_client() is shared
+    assert shared.base_url == "http://anilist.test"
+    client.close_client()
+
+
+def test_fetch_anilist_data_posts_to_shared_client(monkeypatch):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(
+            200,
+            json={"data": {"User": {"id": 1}}},
+            headers={"Date": "Thu, 01 Aug 2024 12:00:00 GMT"},
+        )
+
+    mock_client = httpx.Client(
+        base_url="http://anilist.test", transport=httpx.MockTransport(handler)
+    )
+    monkeypatch.setattr(client, "client", mock_client)
+
+    json_response, response_header = fetch_anilist_data("query", {"name": "user"})
+    assert json_response == {"data": {"User": {"id": 1}}}
+    assert response_header.iloc[0] == "Thu, 01 Aug 2024 12:00:00 GMT"
+    assert [str(request.url) for request in requests] == ["http://anilist.test/"]
+    assert json.loads(requests[0].content)["variables"] == {"name": "user"}
+    mock_client.close()
@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import pytest
+from api import media_cache
+from fastapi.testclient import TestClient
+from main import app
+
+
+@pytest.fixture
+def clock(monkeypatch, tmp_path):
+    monkeypatch.setenv("MEDIA_CACHE_PATH", str(tmp_path / "media_cache.db"))
+    monkeypatch.setattr(
+        media_cache, "counters", {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+    )
+    clock = SimpleNamespace(now=1_000.0)
+    monkeypatch.setattr(media_cache, "time", SimpleNamespace(time=lambda: clock.now))
+    media_cache.close_cache()
+    yield clock
+    media_cache.close_cache()
+
+
+def media(media_id: int) -> dict:
+    return {
+        "id": media_id,
+        "averageScore": 70,
+        "title": {"romaji": f"Title {media_id}"},
+    }
+
+
+def test_media_expire_after_ttl(clock, monkeypatch):
+    monkeypatch.setenv("MEDIA_CACHE_TTL", "60")
+    media_cache.put_media("anime", [media(1), media(2)])
+
+    clock.now += 30
+    cached, missing = media_cache.get_media("anime", [1, 2, 3])
+    assert cached == [media(1), media(2)]
+    assert missing == [3]
+
+    clock.now += 31
+    cached, missing = media_cache.get_media("anime", [1, 2])
+    assert cached == []
+    assert missing == [1, 2]
+    assert media_cache.counters == {
+        "hits": 2,
+        "misses": 3,
+        "expired": 2,
+        "evictions": 0,
+    }
+
+
+def test_least_recently_used_media_are_evicted(clock, monkeypatch):
+    monkeypatch.setenv("MEDIA_CACHE_MAX_ROWS", "2")
+    media_cache.put_media("anime", [media(1)])
+    clock.now += 1
+    media_cache.put_media("manga", [media(2)])
+
+    # NOTE: Reading anime 1 makes manga 2 the least recently used.
+    clock.now += 1
+    media_cache.get_media("anime", [1])
+    clock.now += 1
+    media_cache.put_media("anime", [media(3)])
+
+    assert media_cache.get_media("anime", [1, 3]) == ([media(1), media(3)], [])
+    assert media_cache.get_media("manga", [2]) == ([], [2])
+    assert media_cache.counters["evictions"] == 1
+
+
+def test_metrics_endpoint_reports_counters(clock):
+    media_cache.put_media("anime", [media(1)])
+    media_cache.get_media("anime", [1, 2, 3, 4])
+
+    response = TestClient(app).get("/metrics/media-cache/")
+    assert response.status_code == 200
+    assert response.json() == {
+        "hits": 1,
+        "misses": 3,
+        "expired": 0,
+        "evictions": 0,
+        "hit_rate": 0.25,
+        "rows": 1,
+    }
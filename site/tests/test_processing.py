@@ -0,0 +1,209 @@
+import json
+import random
+import threading
+import time
+
+import httpx
+import pandas as pd
+import pytest
+from api import client, db, media_cache
+from api.processing import (
+    create_abs_avg_plot_data,
+    create_obscurity_data,
+    get_format_info,
+    get_user_data,
+    load_user_stats,
+)
+
+
+def mock_anilist(monkeypatch, handler) -> httpx.Client:
+    mock_client = httpx.Client(
+        base_url="http://anilist.test", transport=httpx.MockTransport(handler)
+    )
+    monkeypatch.setattr(client, "client", mock_client)
+    return mock_client
+
+
+def test_get_user_data_reads_scores_and_user(monkeypatch):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(json.loads(request.content))
+        user = {
+            "id": 42,
+            "name": "user",
+            "statistics": {
+                "anime": {
+                    "scores": [
+                        {"score": 8, "mediaIds": [1, 2]},
+                        {"score": 6, "mediaIds": [3]},
+                    ]
+                }
+            },
+        }
+        return httpx.Response(
+            200,
+            json={"data": {"User": user}},
+            headers={"Date": "Thu, 01 Aug 2024 12:00:00 GMT"},
+        )
+
+    mock_client = mock_anilist(monkeypatch, handler)
+    user_score, user_info, id_list = get_user_data(username="user", format="anime")
+
+    # NOTE: One request resolves the user and returns their scores.
+    assert [request["variables"] for request in requests] == [{"name": "user"}]
+    assert id_list == [1, 2, 3]
+    assert user_score[["user_score", "anime_id", "user_id"]].values.tolist() == [
+        [80, 1, 42],
+        [80, 2, 42],
+        [60, 3, 42],
+    ]
+    assert user_info.to_dict(orient="records") == [
+        {
+            "user_id": 42,
+            "user_name": "user",
+            "request_date": pd.Timestamp("2024-08-01 12:00:00"),
+        }
+    ]
+    mock_client.close()
+
+
+@pytest.mark.parametrize(
+    "status_code, message",
+    [
+        (404, "Username user not found."),
+        (429, "Oops! AniList is a bit overloaded"),
+    ],
+)
+def test_get_user_data_maps_errors(monkeypatch, status_code, message):
+    mock_client = mock_anilist(
+        monkeypatch, lambda request: httpx.Response(status_code, json={})
+    )
+    with pytest.raises(ValueError, match=message):
+        get_user_data(username="user", format="anime")
+    mock_client.close()
+
+
+def test_get_format_info_keeps_page_order_within_concurrency(monkeypatch, tmp_path):
+    monkeypatch.setenv("ANILIST_CONCURRENCY", "2")
+    monkeypatch.setenv("MEDIA_CACHE_PATH", str(tmp_path / "media_cache.db"))
+    media_cache.close_cache()
+
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    rng = random.Random(0)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal in_flight, max_in_flight
+        with lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        # NOTE: Pages finish out of order, the result must not.
+        time.sleep(rng.uniform(0, 0.05))
+        with lock:
+            in_flight -= 1
+
+        id_in = json.loads(request.content)["variables"]["id_in"]
+        media = [
+            {
+                "id": media_id,
+                "averageScore": 70,
+                "title": {"romaji": f"Title {media_id}"},
+                "genres": ["Action"],
+                "popularity": 100,
+                "coverImage": {"extraLarge": None},
+            }
+            for media_id in id_in
+        ]
+        return httpx.Response(
+            200,
+            json={"data": {"Page": {"media": media}}},
+            headers={"Date": "Thu, 01 Aug 2024 12:00:00 GMT"},
+        )
+
+    mock_client = httpx.Client(
+        base_url="http://anilist.test", transport=httpx.MockTransport(handler)
+    )
+    monkeypatch.setattr(client, "client", mock_client)
+
+    id_list = list(range(1000, 1000 - 260, -1))
+    format_info = get_format_info(username="user", id_list=id_list, format="anime")
+
+    assert format_info["anime_id"].tolist() == id_list
+    assert 1 < max_in_flight <= 2
+
+    # NOTE: With a warm cache, cached and fetched titles are still returned in
+    # the order of the id list.
+    id_list = list(range(1100, 950, -1))
+    format_info = get_format_info(username="user", id_list=id_list, format="anime")
+    assert format_info["anime_id"].tolist() == id_list
+    mock_client.close()
+    media_cache.close_cache()
+
+
+@pytest.fixture
+def user_stats(monkeypatch, tmp_path):
+    # NOTE: The stats cache is written relative to the working directory.
+    (tmp_path / "api").mkdir()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'stats.db'}")
+    db.dispose_engine()
+
+    user_stats = pd.DataFrame(
+        {
+            "user_id": [1, 2, 3, 4],
+            "abs_score_diff": [10.2, 9.8, 20.0, None],
+            "avg_score_diff": [-5.4, 4.6, 5.0, None],
+            "average_popularity": [None, 1500.7, 300.2, 80000.0],
+            "list_size": [10, 20, 30, 0],
+            "updated_at": ["2024-08-01 00:00:00.000"] * 4,
+        }
+    )
+    with db.get_engine().begin() as connection:
+        user_stats.to_sql("user_anime_stats", con=connection, index=False)
+    yield user_stats
+    db.dispose_engine()
+
+
+def test_load_user_stats_caches_for_a_day(user_stats):
+    stats = load_user_stats(format="anime")
+    assert stats["user_id"].tolist() == [1, 2, 3, 4]
+    assert "list_size" not in stats
+
+    # NOTE: Rows written after the first load are not read until the cache
+    # file is a day old.
+    with db.get_engine().begin() as connection:
+        user_stats.iloc[[0]].assign(user_id=5).to_sql(
+            "user_anime_stats", con=connection, index=False, if_exists="append"
+        )
+    assert load_user_stats(format="anime")["user_id"].tolist() == [1, 2, 3, 4]
+
+
+def test_abs_avg_plot_data_buckets_users(user_stats):
+    abs_data, avg_data = create_abs_avg_plot_data(
+        format="anime", abs_score_diff=14.6, avg_score_diff=5.2
+    )
+
+    assert abs_data == [
+        {"abs_score_diff": 10, "count": 2},
+        {"abs_score_diff": 15, "count": 1},
+        {"abs_score_diff": 20, "count": 1},
+    ]
+    assert avg_data == [
+        {"avg_score_diff": -5, "count": 1},
+        {"avg_score_diff": 5, "count": 2},
+    ]
+
+
+def test_obscurity_data_appends_user_after_missing_popularity(user_stats):
+    format_df = pd.DataFrame({"popularity": [1000, 3000]})
+    pop_data, user_pop = create_obscurity_data(format="anime", format_df=format_df)
+
+    assert user_pop == 2000
+    assert pop_data == [
+        {"average_popularity": 80000},
+        {"average_popularity": 2000},
+        {"average_popularity": 1500},
+        {"average_popularity": 300},
+    ]
@@ -4,7 +4,8 @@ CREATE TABLE anime_info
     average_score INT          NOT NULL,
     title_romaji  VARCHAR(256) NOT NULL,
     genres        JSON         NOT NULL,
-    popularity    INT          NOT NULL
+    popularity    INT          NOT NULL,
+    content_hash  BIGINT
 );
 
 CREATE TABLE manga_info
@@ -13,7 +14,8 @@ CREATE TABLE manga_info
     average_score INT          NOT NULL,
     title_romaji  VARCHAR(256) NOT NULL,
     genres        JSON         NOT NULL,
-    popularity    INT          NOT NULL
+    popularity    INT          NOT NULL,
+    content_hash  BIGINT
 );
 
 CREATE TABLE user_info
@@ -51,3 +53,88 @@ CREATE TABLE user_manga_score
         REFERENCES manga_info (manga_id)
 );
 
+CREATE INDEX IX_user_anime_score_user_start
+    ON user_anime_score (user_id, start_date DESC)
+    INCLUDE (anime_id, user_score, end_date);
+
+CREATE INDEX IX_user_anime_score_open
+    ON user_anime_score (user_id, anime_id)
+    INCLUDE (user_score)
+    WHERE end_date IS NULL;
+
+CREATE TABLE current_user_anime_score
+(
+    user_id    INT      NOT NULL,
+    anime_id   INT      NOT NULL,
+    user_score INT      NOT NULL,
+    start_date DATETIME NOT NULL,
+    PRIMARY KEY (user_id, anime_id)
+);
+
+CREATE INDEX IX_user_manga_score_user_start
+    ON user_manga_score (user_id, start_date DESC)
+    INCLUDE (manga_id, user_score, end_date);
+
+CREATE INDEX IX_user_manga_score_open
+    ON user_manga_score (user_id, manga_id)
+    INCLUDE (user_score)
+    WHERE end_date IS NULL;
+
+CREATE TABLE current_user_manga_score
+(
+    user_id    INT      NOT NULL,
+    manga_id   INT      NOT NULL,
+    user_score INT      NOT NULL,
+    start_date DATETIME NOT NULL,
+    PRIMARY KEY (user_id, manga_id)
+);
+
+CREATE TABLE user_anime_stats
+(
+    user_id            INT PRIMARY KEY,
+    abs_score_diff     FLOAT,
+    avg_score_diff     FLOAT,
+    average_popularity FLOAT,
+    list_size          INT      NOT NULL,
+    updated_at         DATETIME NOT NULL
+);
+
+CREATE TABLE user_manga_stats
+(
+    user_id            INT PRIMARY KEY,
+    abs_score_diff     FLOAT,
+    avg_score_diff     FLOAT,
+    average_popularity FLOAT,
+    list_size          INT      NOT NULL,
+    updated_at         DATETIME NOT NULL
+);
+
+CREATE TABLE genre
+(
+    genre_id   INT IDENTITY(1,1) PRIMARY KEY,
+    genre_name VARCHAR(64) NOT NULL,
+    CONSTRAINT UQ_genre_name UNIQUE (genre_name)
+);
+
+CREATE TABLE media_genre
+(
+    format   VARCHAR(5) NOT NULL,
+    media_id INT        NOT NULL,
+    genre_id INT        NOT NULL,
+    PRIMARY KEY (format, media_id, genre_id),
+    CONSTRAINT FK_genre FOREIGN KEY (genre_id)
+        REFERENCES genre (genre_id)
+);
+
+CREATE INDEX IX_media_genre_genre
+    ON media_genre (genre_id, format)
+    INCLUDE (media_id);
+
+CREATE TABLE ingest_checkpoint
+(
+    ingest_date   DATE      NOT NULL,
+    user_id       INT       NOT NULL,
+    last_modified DATETIME2 NOT NULL,
+    loaded_at     DATETIME2 NOT NULL,
+    PRIMARY KEY (ingest_date, user_id)
+);
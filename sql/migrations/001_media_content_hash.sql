@@ -0,0 +1,3 @@
+ALTER TABLE anime_info ADD content_hash BIGINT;
+
+ALTER TABLE manga_info ADD content_hash BIGINT;
@@ -0,0 +1,8 @@
+CREATE TABLE ingest_checkpoint
+(
+    ingest_date   DATE      NOT NULL,
+    user_id       INT       NOT NULL,
+    last_modified DATETIME2 NOT NULL,
+    loaded_at     DATETIME2 NOT NULL,
+    PRIMARY KEY (ingest_date, user_id)
+);
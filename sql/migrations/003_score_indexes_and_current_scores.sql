@@ -0,0 +1,63 @@
+CREATE INDEX IX_user_anime_score_user_start
+    ON user_anime_score (user_id, start_date DESC)
+    INCLUDE (anime_id, user_score, end_date);
+
+CREATE INDEX IX_user_anime_score_open
+    ON user_anime_score (user_id, anime_id)
+    INCLUDE (user_score)
+    WHERE end_date IS NULL;
+
+CREATE TABLE current_user_anime_score
+(
+    user_id    INT      NOT NULL,
+    anime_id   INT      NOT NULL,
+    user_score INT      NOT NULL,
+    start_date DATETIME NOT NULL,
+    PRIMARY KEY (user_id, anime_id)
+);
+
+INSERT INTO current_user_anime_score (user_id, anime_id, user_score, start_date)
+SELECT user_id, anime_id, user_score, start_date
+FROM (
+    SELECT
+        user_id, anime_id, user_score, start_date,
+        ROW_NUMBER() OVER(
+            PARTITION BY user_id, anime_id ORDER BY start_date DESC
+        ) AS rn
+    FROM user_anime_score
+    WHERE end_date IS NULL
+    AND start_date IS NOT NULL
+) AS t
+WHERE t.rn = 1;
+
+CREATE INDEX IX_user_manga_score_user_start
+    ON user_manga_score (user_id, start_date DESC)
+    INCLUDE (manga_id, user_score, end_date);
+
+CREATE INDEX IX_user_manga_score_open
+    ON user_manga_score (user_id, manga_id)
+    INCLUDE (user_score)
+    WHERE end_date IS NULL;
+
+CREATE TABLE current_user_manga_score
+(
+    user_id    INT      NOT NULL,
+    manga_id   INT      NOT NULL,
+    user_score INT      NOT NULL,
+    start_date DATETIME NOT NULL,
+    PRIMARY KEY (user_id, manga_id)
+);
+
+INSERT INTO current_user_manga_score (user_id, manga_id, user_score, start_date)
+SELECT user_id, manga_id, user_score, start_date
+FROM (
+    SELECT
+        user_id, manga_id, user_score, start_date,
+        ROW_NUMBER() OVER(
+            PARTITION BY user_id, manga_id ORDER BY start_date DESC
+        ) AS rn
+    FROM user_manga_score
+    WHERE end_date IS NULL
+    AND start_date IS NOT NULL
+) AS t
+WHERE t.rn = 1;
@@ -0,0 +1,53 @@
+CREATE TABLE user_anime_stats
+(
+    user_id            INT PRIMARY KEY,
+    abs_score_diff     FLOAT,
+    avg_score_diff     FLOAT,
+    average_popularity FLOAT,
+    list_size          INT      NOT NULL,
+    updated_at         DATETIME NOT NULL
+);
+
+INSERT INTO user_anime_stats
+(
+    user_id, abs_score_diff, avg_score_diff, average_popularity,
+    list_size, updated_at
+)
+SELECT
+    s.user_id,
+    AVG(CAST(ABS(s.user_score - f.average_score) AS FLOAT)),
+    AVG(CAST(s.user_score - f.average_score AS FLOAT)),
+    AVG(CAST(f.popularity AS FLOAT)),
+    COUNT(*),
+    GETDATE()
+FROM current_user_anime_score AS s
+LEFT JOIN anime_info AS f
+ON f.anime_id = s.anime_id
+GROUP BY s.user_id;
+
+CREATE TABLE user_manga_stats
+(
+    user_id            INT PRIMARY KEY,
+    abs_score_diff     FLOAT,
+    avg_score_diff     FLOAT,
+    average_popularity FLOAT,
+    list_size          INT      NOT NULL,
+    updated_at         DATETIME NOT NULL
+);
+
+INSERT INTO user_manga_stats
+(
+    user_id, abs_score_diff, avg_score_diff, average_popularity,
+    list_size, updated_at
+)
+SELECT
+    s.user_id,
+    AVG(CAST(ABS(s.user_score - f.average_score) AS FLOAT)),
+    AVG(CAST(s.user_score - f.average_score AS FLOAT)),
+    AVG(CAST(f.popularity AS FLOAT)),
+    COUNT(*),
+    GETDATE()
+FROM current_user_manga_score AS s
+LEFT JOIN manga_info AS f
+ON f.manga_id = s.manga_id
+GROUP BY s.user_id;
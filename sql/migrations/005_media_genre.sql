@@ -0,0 +1,37 @@
+CREATE TABLE genre
+(
+    genre_id   INT IDENTITY(1,1) PRIMARY KEY,
+    genre_name VARCHAR(64) NOT NULL,
+    CONSTRAINT UQ_genre_name UNIQUE (genre_name)
+);
+
+CREATE TABLE media_genre
+(
+    format   VARCHAR(5) NOT NULL,
+    media_id INT        NOT NULL,
+    genre_id INT        NOT NULL,
+    PRIMARY KEY (format, media_id, genre_id),
+    CONSTRAINT FK_genre FOREIGN KEY (genre_id)
+        REFERENCES genre (genre_id)
+);
+
+CREATE INDEX IX_media_genre_genre
+    ON media_genre (genre_id, format)
+    INCLUDE (media_id);
+
+INSERT INTO genre (genre_name)
+SELECT genres.value FROM anime_info CROSS APPLY OPENJSON(anime_info.genres) AS genres
+UNION
+SELECT genres.value FROM manga_info CROSS APPLY OPENJSON(manga_info.genres) AS genres;
+
+INSERT INTO media_genre (format, media_id, genre_id)
+SELECT DISTINCT 'anime', anime_info.anime_id, genre.genre_id
+FROM anime_info
+CROSS APPLY OPENJSON(anime_info.genres) AS genres
+INNER JOIN genre ON genre.genre_name = genres.value;
+
+INSERT INTO media_genre (format, media_id, genre_id)
+SELECT DISTINCT 'manga', manga_info.manga_id, genre.genre_id
+FROM manga_info
+CROSS APPLY OPENJSON(manga_info.genres) AS genres
+INNER JOIN genre ON genre.genre_name = genres.value;